@@ -20,12 +20,68 @@
 """
 
 # Standard imports
-import socket, errno, threading, multiprocessing
+import socket, errno, threading, collections, time, codecs, zlib, itertools, traceback, tempfile, mmap, select, sys, os, warnings
 
 # Project imports
-from .utils import MessageHeaders, eintr
+from .utils import MessageHeaders, eintr, wakeup, timerWheel, bufferPool, capture, rateLimiter, tls
 from .exceptions import notReady
 
+# Globals
+
+# Send policies, controlling how messages written to a Stocking are put onto the wire.
+SEND_DEFAULT = 'default'   # Leave the socket's TCP options untouched, sending each message as soon as possible
+SEND_NODELAY = 'nodelay'   # Disable Nagle's algorithm, sending each message as soon as possible
+SEND_COALESCE = 'coalesce' # Gather messages for up to coalesceDelay seconds or coalesceSize bytes before sending them
+
+# Priorities which messages can be written with.  Higher priority messages are always sent before lower priority ones.
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+_PRIORITIES = 3
+
+# Size of the buffer each Stocking receives into.  Messages which do not fit within it are received into buffers of
+# their own.
+RECV_SIZE = 65536
+
+# Type of string/unicode messages
+_TEXT = type(u'')
+
+# Messages smaller than this many bytes are copied into the same segment as their header when sent, rather than being
+# sent as a segment of their own
+_COPY_SIZE = 1024
+
+# Maximum number of segments passed to a single call to sendmsg
+_MAX_SEGMENTS = 512
+
+# Whether or not sockets support sending many segments at once
+_SENDMSG = hasattr(socket.socket, 'sendmsg')
+
+# Socket option asking the kernel to busy poll the device queue for incoming packets when a receive would block; only
+# exposed by the socket module on some versions of Python, but available on Linux regardless
+_SO_BUSY_POLL = getattr(socket, 'SO_BUSY_POLL', 46 if sys.platform.startswith('linux') else None)
+
+# Whether or not select.poll is available, to wait on descriptors which select.select cannot
+_POLL = hasattr(select, 'poll')
+
+# Gives up the processor (and the GIL) to any other thread ready to run, between the checks made while busy polling
+_yield = getattr(os, 'sched_yield', lambda: time.sleep(0))
+
+# Clock used to measure the CPU time spent compressing messages; the CPU time of the calling thread where available
+_cpuTime = getattr(time, 'thread_time', time.time)
+
+# Number of heartbeats which may be missed before the remote is considered unresponsive
+HEARTBEAT_MISSES = 3
+
+# Marker queued by flush, asking our thread to send any coalesced messages immediately
+_FLUSH = None
+
+# Prefix of the message two Stockings exchange to negotiate the features they will use with each other
+_HELLO = b'\x00Stockings\x00'
+
+# Control messages, sent to the remote using extended framing
+_CONTROL_HEARTBEAT = b'h'
+_HEARTBEAT = (bytes, MessageHeaders.MessageHeaders.FLAG_CONTROL, None, _CONTROL_HEARTBEAT)
+
 class _Stocking(threading.Thread):
     """ Base class for a Stocking. """
 
@@ -34,27 +90,117 @@ class _Stocking(threading.Thread):
     addr = None               # The address of the remote
     handshakeComplete = False # A boolean indicating whether or not this connection is ready for interaction with the remote
     active = True             # Flag which signals whether this thread is supposed to be running or not
+    sendPolicy = SEND_DEFAULT # One of SEND_DEFAULT, SEND_NODELAY or SEND_COALESCE; see setSendPolicy
+    coalesceDelay = .0005     # Maximum number of seconds a message may be held back while coalescing writes
+    coalesceSize = 65536      # Number of coalesced bytes which will cause them to be sent immediately
+    heartbeatInterval = None  # If set, the number of idle seconds after which we send the remote a heartbeat
+    readTimeout = None        # If set, the number of seconds without receiving anything after which we close
+    idleTimeout = None        # If set, the number of seconds without sending or receiving a message after which we close
+    negotiate = False         # If set, the remote also sets negotiate and we agree on features with it; see README
+    negotiationTimeout = 10   # Number of seconds to wait for the remote to reply to our offer of features
+    sliceSize = None          # If set, messages larger than this are sent in slices of this many bytes; see README
+    borrowBuffers = False     # If set, bytes messages are read as memoryviews of pooled buffers; see release
+    compression = None        # If set, the zlib compression level (1-9) used to compress messages sent to the remote
+    compressionThreshold = 128 # Messages smaller than this many bytes are never compressed
+    capture = None            # If set, a CaptureWriter which the messages we send and receive are recorded to
+    rateLimiter = None        # If set, a RateLimiter limiting the rate of our traffic; see setRateLimits
+    rateGroup = None          # If set, a RateLimiter shared with other Stockings, limiting the rate of their traffic
+    fixedHeaders = False      # If set, fixed width message headers are used if the remote wishes to use them too
+    tlsContext = None         # If set, an ssl.SSLContext used to encrypt our connection with TLS; see README
+    tlsServerSide = False     # Whether we're the server of our TLS session, rather than the client
+    tlsHostname = None        # If set, the hostname of the server of our TLS session, used to verify its certificate
+    tlsSessionCache = None    # SessionCache our TLS sessions are resumed from if we're the client; by default a shared one
+    edgeTriggered = False     # If set, PollStockings use edge triggered epoll notifications where available; see README
+    maxMessageSize = None     # If set, the remote sending a message larger than this many bytes closes our connection
+    spillThreshold = None     # If set, bytes messages larger than this many bytes are received into temporary files
+    spillDirectory = None     # If set, the directory temporary files are created in; by default the system's
+    busyPoll = None           # If set, the number of seconds to spin waiting for I/O before sleeping; see README
+    broadcastSafe = False     # Set by subclasses whose preWrite depends only on its arguments; see broadcast
+
+    # Attributes which can be overridden by keyword arguments passed to __init__
+    _options = ('sendPolicy', 'coalesceDelay', 'coalesceSize', 'heartbeatInterval', 'readTimeout', 'idleTimeout',
+                'negotiate', 'negotiationTimeout', 'sliceSize', 'borrowBuffers', 'compression', 'compressionThreshold',
+                'capture', 'rateLimiter', 'rateGroup', 'fixedHeaders', 'tlsContext', 'tlsServerSide', 'tlsHostname',
+                'tlsSessionCache', 'edgeTriggered', 'maxMessageSize', 'spillThreshold', 'spillDirectory', 'busyPoll')
 
     # Internal attributes
-    _iBuffer = b""            # Partial message received from the remote that require further recv's to complete
-    _iBufferLen = 0           # Length of the message we're currently receiving into self._iBuffer
+    _rBuffer = None           # Pooled buffer which we receive into from the remote, RECV_SIZE bytes long, or None while idle
+    _rView = None             # memoryview of self._rBuffer
+    _rStart = 0               # Index in self._rBuffer of the first byte received which has not yet been processed
+    _rEnd = 0                 # Index in self._rBuffer of the end of the bytes received
+    _iMessage = None          # Pooled buffer which we're receiving a message too large for self._rBuffer into
+    _iMessageView = None      # memoryview of self._iMessage
+    _iFilled = 0              # Number of bytes of the message which have been received into self._iMessage
+    _iBufferLen = None        # Length of the message we're currently receiving, None if not yet known
     _iType = None             # Type of message that we're receiving (bytes vs string/unicode)
+    _iFlags = 0               # Flags of the message that we're receiving, when using extended framing
+    _iHeaderComplete = False  # Whether or not we've received the entire header of the message we're receiving
+    _iSlices = None           # Dictionary mapping lanes to slices received of messages which are not yet complete
+    _iSliceBytes = None       # Dictionary mapping lanes to the number of bytes in their slices in self._iSlices
     _messageHeaders = None    # MessageHeaders object used when constructing _iBufferLen
-    _oBuffer = ""             # Partial message sent to the remote that require further send's to complete
-    _parentOut = None         # Pipe which our parent process will read from
-    _parentIn = None          # Pipe which our parent process will write to
-    _usIn = None              # Pipe which we will read from
-    _usOut = None             # Pipe which we will write to
-    _ioLock = None            # Mutex to prevent us from interfacing with a pipe at the same time
-
-    def __init__(self, conn):
+    _oBuffer = None           # Deque of segments of messages which are waiting to be sent to the remote
+    _oLength = 0              # Number of bytes in self._oBuffer
+    _oQueued = 0              # Number of bytes which have ever been added to self._oBuffer
+    _oSent = 0                # Number of bytes which have ever been sent from self._oBuffer
+    _oCallbacks = None        # Deque of (self._oQueued, callback) tuples, to be called once that many bytes are sent
+    _oDeadline = 0            # Time at which the messages in self._oBuffer must be sent, or 0 if they're to be sent now
+    _oFraming = False         # Set while our thread is moving frames from self._outQueues into self._oBuffer
+    _inQueue = None           # Queue of messages received from the remote, waiting to be read by our parent
+    _outQueues = None         # List of queues of frames written by our parent, waiting to be sent to the remote; one
+                              # for each priority
+    _parentWakeup = None      # Wakeup which our parent polls on, set when we add to self._inQueue
+    _ioWakeup = None          # Wakeup which we poll on, set when our parent adds to self._outQueues
+    _fileno = None            # File descriptor of self._parentWakeup
+    _drained = None           # Event set by our thread once it has sent everything queued, when self._draining is set
+    _draining = False         # Flag indicating whether or not our parent is waiting on self._drained
+    _ioLock = None            # Mutex serializing the closing of this Stocking, and the arming of self._timer
+    _offered = False          # Whether or not we've sent the remote a hello, offering it features
+    _negotiating = False      # Whether or not we're holding back messages while awaiting the remote's hello
+    _negotiationExpired = False # Set once the remote has taken longer than self.negotiationTimeout to send its hello
+    _negotiated = None        # Event set once we're no longer negotiating features with the remote
+    _negotiationTimer = None  # Timer on the shared TimerWheel which expires our negotiation
+    _helloExpected = False    # Whether or not the next message received from the remote may be its hello
+    _iExtended = False        # Whether or not the remote is sending to us using extended framing
+    _oExtended = False        # Whether or not we're sending to the remote using extended framing
+    _iFixed = False           # Whether or not the remote is sending to us using fixed width headers
+    _oFixed = False           # Whether or not we're sending to the remote using fixed width headers
+    _peerOffer = None         # Dictionary of features offered by the remote in its hello, or None if it sent none
+    _timer = None             # Timer on the shared TimerWheel, scheduled for our next heartbeat or timeout
+    _timed = False            # Whether or not we have any heartbeats or timeouts to keep track of
+    _lastRecv = None          # Time we last received anything from the remote
+    _lastSent = None          # Time we last sent anything to the remote
+    _lastActivity = None      # Time we last sent or received a message
+    _compressor = None        # zlib compression stream used for messages sent to the remote, once negotiated
+    _decompressor = None      # zlib decompression stream used for compressed messages received from the remote
+    _compressStats = None     # List of [messages, bytes before, bytes after, CPU seconds] compressing messages sent
+    _decompressStats = None   # List of [messages, bytes before, bytes after, CPU seconds] decompressing those received
+    _captureStream = None     # Our stream number in self.capture
+    _limiters = ()            # Tuple of the RateLimiters which apply to us; self.rateLimiter and self.rateGroup
+    _detaching = False        # Set by our parent to ask our thread to exit without closing our connection
+    _detachedState = None     # Dictionary describing the state of our connection, saved by our thread as it detaches
+    _resumed = False          # Whether or not we're resuming a connection detached from another Stocking
+    _tls = None               # TLSConnection encrypting our connection, if self.tlsContext is set
+    _noDelay = None           # Value of our socket's TCP_NODELAY option before our send policy changed it, if it has
+
+    def __init__(self, conn, **options):
         """
         Creates a new connection, wrapping the given connected socket.
 
-        Inputs: conn - A connected socket.
+        Inputs: conn    - A connected socket.
+                options - Keyword arguments overriding any of our configurable attributes (see self._options) for this
+                          connection; for example heartbeatInterval=5.
         """
 
         threading.Thread.__init__(self)
+
+        # The state of a connection detached from another Stocking, which we're to resume; see recvStocking
+        resumeState = options.pop('_resumeState', None)
+
+        for name, value in options.items():
+            if name not in self._options:
+                raise TypeError("Unexpected option: %s" % name)
+            setattr(self, name, value)
+
         self.sock = conn
         self.addr = self.sock.getpeername()
         self._messageHeaders = MessageHeaders.MessageHeaders()
@@ -63,16 +209,85 @@ class _Stocking(threading.Thread):
         # the remote and receiving a message from the remote.  We cannot get stuck in one phase or the other.
         self.sock.setblocking(0)
 
-        # Create two unidirectional pipes for communicating with our parent process
-        self._parentIn, self._usOut = multiprocessing.Pipe(False)
-        self._usIn, self._parentOut = multiprocessing.Pipe(False)
+        if self.tlsContext is not None:
+            if resumeState is not None:
+                raise ValueError("Connections encrypted with TLS cannot be resumed")
+
+            # Client sessions are cached by the server's hostname where given, otherwise by its address
+            self._tls = tls.TLSConnection(
+                self.sock, self.tlsContext, self.tlsServerSide, self.tlsHostname,
+                self.tlsSessionCache if self.tlsSessionCache is not None else tls.getSessionCache(),
+                self.tlsHostname or self.addr
+            )
+
+        # Messages are passed between us and our parent process using a pair of single producer, single consumer
+        # queues, which require no locking.  Each queue has a Wakeup which its consumer can poll on.
+        self._inQueue = collections.deque()
+        self._outQueues = [collections.deque() for _ in range(_PRIORITIES)]
+        self._iSlices = {}
+        self._iSliceBytes = {}
+        self._oBuffer = collections.deque()
+        self._oCallbacks = collections.deque()
+        self._parentWakeup = wakeup.Wakeup()
+        self._ioWakeup = wakeup.Wakeup()
+        self._fileno = self._parentWakeup.fileno()
+        self._drained = threading.Event()
+        self._negotiated = threading.Event()
+        self._compressStats = [0, 0, 0, 0.0]
+        self._decompressStats = [0, 0, 0, 0.0]
+        if self.capture is not None:
+            self._captureStream = self.capture.stream()
 
         self._ioLock = threading.RLock()
 
+        self.setSendPolicy(self.sendPolicy)
+        if self.busyPoll:
+            self._setBusyPoll()
+        self._limiters = tuple(limiter for limiter in (self.rateLimiter, self.rateGroup) if limiter is not None)
+
+        self._lastRecv = self._lastSent = self._lastActivity = time.time()
+        self._timed = bool(self.heartbeatInterval or self.readTimeout or self.idleTimeout)
+
+        # Our TLS handshake must begin before anything else is sent; our thread sends whatever it produces
+        if self._tls is not None:
+            self._tls.start()
+            self._ioWakeup.set()
+
+        if resumeState is not None:
+            self._resume(resumeState)
+
+        # Hellos are only exchanged once both ends have opted in; a remote which has not (such as one using a version
+        # of Stockings predating negotiation) would receive our hello as a regular message
+        elif self.negotiate:
+            self._helloExpected = True
+
+            # If we have features to offer the remote, our hello must be the very first message we send it
+            offer = self._offer()
+            if offer:
+                self._offered = self._negotiating = True
+                self._bufferFrame(self._frame(_HELLO + self._encodeOffer(offer)))
+                self._ioWakeup.set()
+                self._negotiationTimer = timerWheel.getTimerWheel().schedule(
+                    self.negotiationTimeout, self._expireNegotiation
+                )
+            else:
+                self._negotiated.set()
+
+        else:
+            # Our features would otherwise be silently ignored; a remote cannot agree to what we never offer it
+            offer = self._offer()
+            if offer:
+                warnings.warn("%s are only used once negotiated; set negotiate to enable them" %
+                              ", ".join(sorted(offer)), stacklevel=2)
+            self._negotiated.set()
+
         # Start processing requests
         self.daemon = True
         self.start()
 
+        if self._timed:
+            self._armTimer()
+
 
     # Data Model functions
     def __repr__(self):
@@ -88,9 +303,13 @@ class _Stocking(threading.Thread):
 
 
     # API functions
-    def read(self):
+    def read(self, timeout=0):
         """
-        Returns a message from _parentIn if there is one and we've completed our handshake, else None.
+        Returns a message received from the remote if there is one and we've completed our handshake, else None.
+
+        Inputs: timeout - The maximum number of seconds to wait for a message to be received if there is none, or None
+                          to wait until there is one or we close.  When self.busyPoll is set, we spin waiting for a
+                          message for up to that many seconds before sleeping.
 
         Raises a NotReady Exception if the handshake has not yet completed.
         """
@@ -99,6 +318,8 @@ class _Stocking(threading.Thread):
             raise notReady.NotReady()
 
         toReturn = self._read()
+        if toReturn is None and timeout != 0:
+            toReturn = self._waitRead(timeout)
         if toReturn is not None:
             return self.postRead(toReturn)
 
@@ -107,37 +328,260 @@ class _Stocking(threading.Thread):
         """
         Queues a message to send to the remote if we've completed our handshake.
 
+        Accepts an optional keyword argument `priority`; one of PRIORITY_HIGH, PRIORITY_NORMAL (the default) or
+        PRIORITY_LOW, which is not passed on to preWrite.  Queued messages of a higher priority are sent before those of
+        a lower priority.
+
+        Also accepts an optional keyword argument `onSent`, which is not passed on to preWrite; a function which will be
+        called by our thread once the message has been handed to the socket (or copied when detaching), being passed
+        True, or False if we closed before it could be sent.  Messages which support the buffer protocol are sent without being copied, and so
+        must not be modified until then.
+
         Raises a NotReady Exception if the handshake has not yet completed.
         """
 
         if not self.handshakeComplete:
             raise notReady.NotReady()
 
-        self._write(self.preWrite(*args, **kwargs))
+        priority = kwargs.pop('priority', PRIORITY_NORMAL)
+        onSent = kwargs.pop('onSent', None)
+        self._write(self.preWrite(*args, **kwargs), priority, onSent)
 
 
     def fileno(self):
         """ Returns a file descriptor which the parent process can poll on, to wake when there is input to be read. """
 
-        return self._runLocked(self._parentIn.fileno)
+        return self._fileno
 
 
-    def close(self):
-        """ Kills our connection and immediately halts the thread. """
+    def close(self, drain=False, timeout=None):
+        """
+        Kills our connection and halts the thread.
+
+        Inputs: drain   - If True, waits for any queued messages to be sent to the remote before closing.
+                timeout - The maximum number of seconds to wait for queued messages to be sent when draining, or None
+                          to wait indefinitely.  Once it elapses, the connection is closed regardless.
+        """
+
+        if drain:
+            self.drain(timeout)
 
         def __close(self):
             if self.active:
                 self._signalClose()
-                if not self._parentIn.closed:
-                    self._parentIn.close()
+            # Our parent's wakeup must be closed even if we've already closed for other reasons (for example the remote
+            # closing our connection), as only our parent knows when it is no longer polling on it
+            self._parentWakeup.close()
 
         self._runLocked(__close, self)
 
 
+    def detach(self, timeout=None):
+        """
+        Stops our thread without closing our connection, so that it can be resumed by another Stocking, typically in
+        another process (see sendStocking).  Once detached, this Stocking is no longer active, and self.sock should be
+        closed by the caller once it has been handed on.
+
+        Raises a NotReady Exception if the handshake has not yet completed, or a ValueError if we've closed or are using
+        compression or TLS, whose state cannot be handed on.
+
+        Inputs: timeout - The maximum number of seconds to wait for our thread to stop, or None to wait indefinitely.
+
+        Outputs: A dictionary describing the state of our connection, including any messages which have been received
+                 but not yet read and any which have been written but not yet sent, which can be pickled.
+        """
+
+        if not self.handshakeComplete:
+            raise notReady.NotReady()
+
+        if self._compressor is not None or self._decompressor is not None:
+            raise ValueError("Stockings using compression cannot be detached")
+
+        if self._tls is not None:
+            raise ValueError("Stockings using TLS cannot be detached")
+
+        with self._ioLock:
+            if not self.active:
+                raise ValueError("Cannot detach a closed Stocking")
+            self._detaching = True
+            self._ioWakeup.set()
+
+        self.join(timeout)
+        if self.is_alive():
+            raise ValueError("Timed out waiting for %r to detach" % self)
+
+        return self._detachedState
+
+
+    def drain(self, timeout=None):
+        """
+        Blocks until every message queued before this call has been handed to the remote's socket, flushing any
+        messages being held back while coalescing writes.
+
+        Inputs: timeout - The maximum number of seconds to wait, or None to wait indefinitely.
+
+        Outputs: A boolean; True if all queued messages were sent, or False if we timed out or closed first.
+        """
+
+        if not self.active:
+            return not self.writeDataQueued()
+
+        self._drained.clear()
+        self._draining = True
+        if not self.writeDataQueued():
+            return True
+        # Our thread clears self.active before setting self._drained as it tears down, so checking again after clearing
+        # the event guarantees we cannot wait on a set which already happened
+        if not self.active:
+            return False
+
+        # Queueing a flush both sends any messages being held back and guarantees our thread will wake up after
+        # self._draining was set, to notice that it must set self._drained once it has sent everything.
+        self.flush()
+        self._drained.wait(timeout)
+
+        return not self.writeDataQueued()
+
+
+    def flush(self):
+        """ Asks our thread to immediately send any messages which are being held back while coalescing writes. """
+
+        # Flushes are queued with the lowest priority, so that they follow every message queued before them
+        self._queueFrame(_FLUSH, PRIORITY_LOW)
+
+
+    def release(self, message):
+        """
+        Returns the buffer of a message read while self.borrowBuffers is set to the pool, so that it can be reused, or
+        closes a message which was spilled to a temporary file.  The message must not be used after it has been released.
+
+        Inputs: message - A memoryview or mmap returned by read.
+        """
+
+        if isinstance(message, mmap.mmap):
+            message.close()
+            return
+
+        buf = message.obj
+        message.release()
+        bufferPool.getBufferPool().release(buf)
+
+
+    def setSendPolicy(self, policy, delay=None, size=None):
+        """
+        Sets the policy controlling how messages written to this Stocking are put onto the wire.
+
+        Inputs: policy - SEND_DEFAULT to leave the socket's TCP options untouched.
+                         SEND_NODELAY to disable Nagle's algorithm, favouring latency over packets sent.
+                         SEND_COALESCE to gather messages into as few sends as possible, holding each back for at most
+                                       `delay` seconds, or until `size` bytes have been gathered.  Nagle's algorithm is
+                                       disabled so that gathered messages are not further delayed once sent.
+                delay  - If given, overrides self.coalesceDelay.
+                size   - If given, overrides self.coalesceSize.
+        """
+
+        if policy not in (SEND_DEFAULT, SEND_NODELAY, SEND_COALESCE):
+            raise ValueError("Unknown send policy: %r" % (policy,))
+
+        if delay is not None:
+            self.coalesceDelay = delay
+        if size is not None:
+            self.coalesceSize = size
+
+        # TCP_NODELAY only applies to TCP sockets.  Its original value is restored on returning to SEND_DEFAULT.
+        if self.sock.family in (socket.AF_INET, getattr(socket, 'AF_INET6', None)):
+            if policy != SEND_DEFAULT:
+                if self._noDelay is None:
+                    self._noDelay = self.sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY)
+                self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            elif self._noDelay is not None:
+                self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, self._noDelay)
+                self._noDelay = None
+
+        self.sendPolicy = policy
+
+
     def writeDataQueued(self):
         """ Returns a boolean indicating whether or not there is data waiting to be sent to the endpoint."""
 
-        return self._usIn.poll() or len(self._oBuffer)
+        # Our thread sets self._oFraming before taking frames from self._outQueues, and clears it only once they've
+        # been added to self._oBuffer; checking in this order, a frame between the two is always seen in one of them
+        return bool(self._framesQueued() or self._oFraming or self._oLength)
+
+
+    def setRateLimits(self, **limits):
+        """
+        Changes the limits on the rate of traffic sent to and received from the remote, creating self.rateLimiter if
+        necessary.
+
+        Inputs: limits - Any of the keyword arguments accepted by RateLimiter.setLimits; sendBytes, sendMessages,
+                         recvBytes and recvMessages, each giving a rate per second, or None to remove the limit.
+        """
+
+        if self.rateLimiter is None:
+            self.rateLimiter = rateLimiter.RateLimiter()
+            self._limiters = (self.rateLimiter,) + self._limiters
+        self.rateLimiter.setLimits(**limits)
+
+        # Wake our thread, so that it reconsiders when it may next send or receive
+        self._ioWakeup.set()
+
+
+    def rateLimitState(self):
+        """
+        Returns the state of the limits on the rate of our traffic.
+
+        Outputs: A dictionary with the keys 'connection' and 'group', mapping to the state of self.rateLimiter and
+                 self.rateGroup respectively (see RateLimiter.state), or None if they are not set.
+        """
+
+        return {
+            'connection': self.rateLimiter.state() if self.rateLimiter is not None else None,
+            'group': self.rateGroup.state() if self.rateGroup is not None else None
+        }
+
+
+    def tlsState(self):
+        """
+        Returns the state of our TLS session, or None if we're not using TLS.
+
+        Outputs: A dictionary containing:
+                    established  - Whether or not the session's handshake has completed.
+                    version      - The TLS version in use, once established.
+                    cipher       - The name of the cipher in use, once established.
+                    resumed      - Whether or not the session resumed one cached from an earlier connection.
+                    error        - The ssl.SSLError which ended the session, if any.
+        """
+
+        if self._tls is not None:
+            return self._tls.state()
+
+
+    def compressionStats(self):
+        """
+        Returns statistics on the compression of messages sent to and received from the remote.
+
+        Outputs: A dictionary with the keys 'sent' and 'received', each mapping to a dictionary containing:
+                    messages     - The number of messages which were compressed.
+                    bytes        - The number of bytes those messages took before compression.
+                    compressed   - The number of bytes those messages took after compression.
+                    ratio        - bytes / compressed, or None if no messages were compressed.
+                    cpuTime      - The number of CPU seconds spent compressing (or decompressing) them.
+        """
+
+        stats = {}
+        for key, (messages, before, after, cpuTime) in (('sent', self._compressStats),
+                                                        ('received', self._decompressStats)):
+            stats[key] = {
+                'messages': messages,
+                'bytes': before,
+                'compressed': after,
+                'ratio': (float(before) / after) if after else None,
+                'cpuTime': cpuTime
+            }
+
+        return stats
 
 
     # Subclassable functions
@@ -159,6 +603,48 @@ class _Stocking(threading.Thread):
         return True
 
 
+    def _offer(self):
+        """
+        Function returning the features we will offer the remote in our hello.
+
+        Outputs: A dictionary mapping the names of features to string values.  If it is empty, no hello is sent and
+                 no features are negotiated unless the remote offers its own.
+        """
+
+        offer = {}
+        if self.heartbeatInterval:
+            offer['heartbeat'] = repr(float(self.heartbeatInterval))
+        if self.sliceSize:
+            offer['slices'] = str(self.sliceSize)
+        if self.compression:
+            offer['compress'] = 'zlib'
+        if self.fixedHeaders:
+            offer['headers'] = 'fixed'
+
+        return offer
+
+
+    def _accept(self, peerOffer):
+        """
+        Function called by our thread once both we and the remote have sent our hellos, being passed the features
+        offered by the remote.  Extended framing will be used in both directions from this point on.
+
+        Inputs: peerOffer - A dictionary mapping the names of features offered by the remote to string values.
+        """
+
+        if 'heartbeat' in peerOffer and not self.readTimeout:
+            self._timed = True
+
+        # Messages are only compressed if both we and the remote wish to, using a single stream for the lifetime of the
+        # connection so that similar messages compress well
+        if self.compression and peerOffer.get('compress') == 'zlib':
+            self._compressor = zlib.compressobj(self.compression)
+
+        # Likewise fixed width headers, which take effect following the hellos each of us sent
+        if self.fixedHeaders and peerOffer.get('headers') == 'fixed':
+            self._iFixed = self._oFixed = True
+
+
     def postRead(self, message):
         """
         Function which will be called, being passed a complete message from the remote.
@@ -190,46 +676,251 @@ class _Stocking(threading.Thread):
         Returns the message received from the remote if there is one, else None.
         """
 
-        return self._recvPipe(self._parentIn)
+        try:
+            return self._inQueue.popleft()
+
+        except IndexError:
+            pass
+
+        # Our queue is empty; clear our parent's wakeup so that fileno is no longer readable.  As a message may have
+        # been queued after we found the queue empty but before we cleared the wakeup, check it once more.
+        self._parentWakeup.clear()
+        if len(self._inQueue):
+            self._parentWakeup.set()
+            try:
+                return self._inQueue.popleft()
 
+            except IndexError:
+                pass
 
-    def _write(self, msg):
+
+    def _waitRead(self, timeout):
+        """
+        Waits for a message to be received from the remote; spinning for up to self.busyPoll seconds, then sleeping
+        until our parent's wakeup is set.
+
+        Inputs: timeout - The maximum number of seconds to wait, or None to wait until a message is received or we close.
+
+        Outputs: The message received, or None if there was none before timeout elapsed or we closed.
+        """
+
+        start = time.time()
+        spinUntil = start + (self.busyPoll or 0)
+        deadline = None if timeout is None else start + timeout
+
+        # select.select cannot wait on descriptors numbered beyond FD_SETSIZE, which ours may well be when there are
+        # many Stockings, so poll is used where it's available
+        poller = None
+        if _POLL:
+            poller = select.poll()
+            poller.register(self._fileno, select.POLLIN)
+
+        while True:
+            toReturn = self._read()
+            if toReturn is not None or not self.active:
+                return toReturn
+
+            now = time.time()
+            if deadline is not None and now >= deadline:
+                return None
+            # Spinning without yielding would starve our thread of the chance to queue the message
+            if now < spinUntil:
+                _yield()
+                continue
+
+            wait = None if deadline is None else deadline - now
+            try:
+                if poller is not None:
+                    poller.poll(None if wait is None else wait * 1000)
+                else:
+                    select.select([self._fileno], [], [], wait)
+
+            # Our parent's wakeup may have been closed as we closed, which we notice above
+            except (select.error, socket.error):
+                if self.active:
+                    raise
+
+
+    def _write(self, msg, priority=PRIORITY_NORMAL, onSent=None):
         """
         Function implementing the logic for sending a message to the host.
 
         Should only be called by this object, and only when performing a handshake with the remote.
         """
 
-        if len(msg):
-            typ = type(msg)
-            if type(msg) != bytes:
+        frame = self._frame(msg)
+        if not self._canSend(frame):
+            raise ValueError("Message of %d bytes is too long to send with fixed width headers" % len(frame[3]))
+
+        if len(frame[3]):
+            self._queueFrame(frame, priority)
+
+        # The callback follows the message through its queue, and is called once everything before it has been sent
+        if onSent is not None:
+            self._queueFrame(onSent, priority)
+
+
+    @staticmethod
+    def _frame(msg):
+        """
+        Prepares a message to be queued for sending to the remote.
+
+        Inputs: msg - The message to frame; a bytes or string/unicode object, or any other object supporting the buffer
+                      protocol, which is sent as bytes.
+
+        Outputs: A frame; a tuple containing the type of the message, its flags, its message size header (for use
+                 when not using extended framing) and the message encoded as bytes (or a memoryview of the object).
+        """
+
+        typ = type(msg)
+        if typ != bytes:
+            if isinstance(msg, _TEXT):
                 msg = msg.encode('utf8')
 
-            msg = self._messageHeaders.serialize(typ, len(msg)) + msg
+            # Other objects are referenced rather than copied, viewed as a flat sequence of bytes.  Those which are not
+            # contiguous (such as strided slices) cannot be sent from directly, and are copied instead.
+            else:
+                msg = memoryview(msg)
+                if not msg.c_contiguous:
+                    msg = msg.tobytes()
+                elif msg.ndim != 1 or msg.format != 'B':
+                    msg = msg.cast('B')
+                typ = bytes
 
-            if not self._parentOut.closed:
-                self._parentOut.send(msg)
+        return (typ, 0, MessageHeaders.MessageHeaders.serialize(typ, len(msg)), msg)
 
 
-    def _recvPipe(self, pipe):
+    def _canSend(self, frame):
         """
-        Receives from a pipe, ensuring that it can be read from.
-        Returns whatever the pipe has returned if possible, else None if it is not possible.
+        Returns a boolean indicating whether or not a frame can be sent to the remote; frames too long for a fixed width
+        header cannot be once we've agreed to use them, or while we're negotiating to.
         """
 
-        def __recvPipe(pipe):
-            if self._checkReadablePipe(pipe):
-                return pipe.recv()
+        if self._oFixed or (self._negotiating and self.fixedHeaders):
+            return len(frame[3]) <= MessageHeaders.MessageHeaders.FIXED_MAX_LENGTH
+
+        return True
+
+
+    def _serializeFrame(self, frame, flags=0):
+        """
+        Serializes a frame into the form which is sent over the wire; the message size header (and flags, if we're
+        using extended framing) followed by the message itself.
+
+        Inputs: frame - A frame, as returned by _frame.
+                flags - Flags to send along with those of the frame, if we're using extended framing.
+
+        Outputs: A tuple containing the header of the serialized frame as bytes, and the message itself.
+        """
+
+        typ, frameFlags, header, msg = frame
+        if self._oFixed:
+            header = MessageHeaders.MessageHeaders.serializeFixed(typ, len(msg), frameFlags | flags)
+        elif self._oExtended:
+            header = MessageHeaders.MessageHeaders.serialize(typ, len(msg)) + \
+                     MessageHeaders.MessageHeaders.serializeFlags(frameFlags | flags)
+
+        return header, msg
 
-        return self._runLocked(__recvPipe, pipe)
 
+    def _bufferFrame(self, frame, flags=0):
+        """
+        Serializes a frame, adding it to self._oBuffer to be sent to the remote.  Large messages are added as segments
+        of their own, so that they can be sent without being copied.
 
-    def _checkReadablePipe(self, pipe):
+        Inputs: frame - A frame, as returned by _frame.
+                flags - Flags to send along with those of the frame, if we're using extended framing.
         """
-        Checks if a readable pipe has data to be read.  Returns True if so, else False.
+
+        header, msg = self._serializeFrame(frame, flags)
+        if len(msg) < _COPY_SIZE:
+            self._oBuffer.append(header + msg)
+        else:
+            self._oBuffer.append(header)
+            self._oBuffer.append(msg)
+
+        length = len(header) + len(msg)
+        self._oLength += length
+        self._oQueued += length
+
+
+    @staticmethod
+    def _encodeOffer(offer):
+        """ Encodes a dictionary of features into the bytes sent in a hello. """
+
+        return ";".join("%s=%s" % (key, offer[key]) for key in sorted(offer)).encode('ascii')
+
+
+    @staticmethod
+    def _decodeOffer(encoded):
+        """ Decodes the bytes sent in a hello into a dictionary of features. """
+
+        offer = {}
+        for feature in encoded.decode('ascii').split(";"):
+            if "=" in feature:
+                key, value = feature.split("=", 1)
+                offer[key] = value
+
+        return offer
+
+
+    def _queueFrame(self, frame, priority=PRIORITY_NORMAL):
         """
+        Queues a frame to be sent to the remote by our thread.  The frame is queued as is, and so can be shared between
+        many Stockings.
 
-        return self._runLocked(lambda: not pipe.closed and pipe.poll())
+        Inputs: frame    - A frame, as returned by _frame.
+                priority - The priority to send the frame with.
+        """
+
+        if not 0 <= priority < _PRIORITIES:
+            raise ValueError("Unknown priority: %r" % (priority,))
+
+        if self.active:
+            if self.capture is not None and isinstance(frame, tuple) and not frame[1]:
+                self._captureMessage(capture.CAPTURE_SENT, frame[3], frame[0] == bytes)
+            self._outQueues[priority].append(frame)
+            self._ioWakeup.set()
+
+
+    def _framesQueued(self):
+        """ Returns a boolean indicating whether or not any frames are queued in self._outQueues. """
+
+        for queue in self._outQueues:
+            if len(queue):
+                return True
+
+        return False
+
+
+    def _nextFrame(self):
+        """
+        Removes the next frame to send from self._outQueues, slicing it if it is larger than self.sliceSize and we're
+        using extended framing, in which case the remainder of the frame is left at the front of its queue.
+
+        Outputs: A tuple containing the frame to send and the flags to send it with, or None if no frames are queued.
+        """
+
+        for priority, queue in enumerate(self._outQueues):
+            try:
+                frame = queue.popleft()
+
+            except IndexError:
+                continue
+
+            # Flushes and callbacks are returned as is
+            if not isinstance(frame, tuple) or not self._oExtended:
+                return frame, 0
+
+            flags = priority << MessageHeaders.MessageHeaders.FLAG_LANE_SHIFT
+            msg = frame[3]
+            if self.sliceSize and len(msg) > self.sliceSize:
+                msg = memoryview(msg)
+                queue.appendleft((frame[0], frame[1], None, msg[self.sliceSize:]))
+                frame = (frame[0], frame[1], None, msg[:self.sliceSize])
+                flags |= MessageHeaders.MessageHeaders.FLAG_MORE
+
+            return frame, flags
 
 
     def _runLocked(self, func, *args, **kwargs):
@@ -241,30 +932,187 @@ class _Stocking(threading.Thread):
             return func(*args, **kwargs)
 
 
-    def _signalClose(self):
+    def _signalClose(self, closeSocket=True):
         """
         Should only be called by this thread.  Signals to any parent process polling on self.fileno() that we have closed.
 
         The parent process should still call close to close the other ends of the pipes.
+
+        Inputs: closeSocket - Whether or not to close our connection to the remote.  It is left open when detaching.
         """
 
         def __signalClose(self):
             if self.active:
                 self.active = False
-                # Only close parentOut; leave parentIn open.  If we're closing for reasons other than our parent telling
-                # us to close, by leaving parentIn open we allow it to consume any potential remaining messages.
-                if not self._parentOut.closed:
-                    self._parentOut.close()
-                if not self._usOut.closed:
-                    self._usOut.close()
-                if not self._usIn.closed:
-                    self._usIn.close()
-                self.sock.shutdown(socket.SHUT_RDWR)
+                # Wake our thread if it is waiting on input from our parent, so that it can exit.  Our wakeups are
+                # closed by our thread as it exits; self._inQueue is left intact so that if we're closing for reasons
+                # other than our parent telling us to close it can consume any potential remaining messages.
+                self._ioWakeup.set()
+                if not closeSocket:
+                    return
+
+                try:
+                    self.sock.shutdown(socket.SHUT_RDWR)
+
+                except socket.error:
+                    pass
+
                 self.sock.close()
 
         self._runLocked(__signalClose, self)
 
 
+    def _teardown(self):
+        """
+        Should only be called by this thread, as it exits.  Signals that we have closed, and releases the resources
+        used to communicate with our parent process.
+        """
+
+        # If we're being detached, save the state of our connection before releasing our buffers, leaving it open
+        if self._detaching:
+            self._detachedState = self._saveState()
+        if self._tls is not None:
+            self._tls.close()
+        self._signalClose(not self._detaching)
+
+        # Wake any parent waiting on us to drain or negotiate; we will not be sending anything further
+        self._drained.set()
+        self._negotiated.set()
+
+        def __teardown(self):
+            # Return our buffers to the pool
+            pool = bufferPool.getBufferPool()
+            self._releaseRecvBuffer()
+            if self._iMessage is not None:
+                self._iMessageView.release()
+                if isinstance(self._iMessage, mmap.mmap):
+                    self._iMessage.close()
+                else:
+                    pool.release(self._iMessage)
+                self._iMessage = None
+
+            if self._timer is not None:
+                timerWheel.getTimerWheel().cancel(self._timer)
+                self._timer = None
+            if self._negotiationTimer is not None:
+                timerWheel.getTimerWheel().cancel(self._negotiationTimer)
+                self._negotiationTimer = None
+            self._ioWakeup.close()
+            # Closing the writing end of our parent's wakeup leaves fileno permanently readable, so that a parent
+            # polling on it will be woken and notice that we have closed.
+            self._parentWakeup.closeWriter()
+
+        self._runLocked(__teardown, self)
+
+        # Let anyone waiting on messages which were not sent know that they never will be by us.  When detaching, they
+        # have been copied into our saved state to be sent by whichever Stocking resumes it, but callbacks cannot be
+        # handed on with them.
+        callbacks = [callback for _, callback in self._oCallbacks]
+        for queue in self._outQueues:
+            callbacks.extend(frame for frame in queue if frame is not _FLUSH and not isinstance(frame, tuple))
+        self._oCallbacks.clear()
+        for callback in callbacks:
+            self._callback(callback, False)
+
+
+    def _saveState(self):
+        """
+        Should only be called by this thread, as it detaches.  Returns a dictionary describing the state of our
+        connection, from which another Stocking can resume it; see _resume.
+        """
+
+        if self._iMessage is not None:
+            received = self._iMessageView[:self._iFilled].tobytes()
+        elif self._rBuffer is not None:
+            received = self._rView[self._rStart:self._rEnd].tobytes()
+        else:
+            received = b""
+
+        return {
+            'family': self.sock.family,
+            'type': self.sock.type,
+            'extended': (self._iExtended, self._oExtended),
+            'fixed': (self._iFixed, self._oFixed),
+            'helloExpected': self._helloExpected,
+            'offer': self._offer() if self._offered else {},
+            'peerOffer': self._peerOffer,
+            'header': (self._iBufferLen, self._iType, self._iFlags, self._iHeaderComplete,
+                       self._messageHeaders.getState()),
+            'received': received,
+            'slices': self._iSlices,
+            'inQueue': [self._copyMessage(message) for message in self._inQueue],
+            'sending': b"".join(self._oBuffer),
+            'queued': [[frame[:3] + (bytes(frame[3]),) for frame in queue if isinstance(frame, tuple)]
+                       for queue in self._outQueues]
+        }
+
+
+    @staticmethod
+    def _copyMessage(message):
+        """
+        Returns a message waiting to be read which can be pickled; borrowed buffers and spilled messages are copied
+        into bytes, and other messages returned as they are.
+        """
+
+        if isinstance(message, memoryview):
+            return message.tobytes()
+
+        if isinstance(message, mmap.mmap):
+            return message[:]
+
+        return message
+
+
+    def _resume(self, state):
+        """
+        Called during initialization to resume a connection detached from another Stocking, rather than negotiating
+        features and handshaking with the remote anew.
+
+        Inputs: state - A dictionary describing the state of the connection, as returned by _saveState.
+        """
+
+        self._resumed = self._offered = self.handshakeComplete = True
+        self._helloExpected = state['helloExpected']
+        self._iExtended, self._oExtended = state['extended']
+        self._iFixed, self._oFixed = state['fixed']
+        self._peerOffer = state['peerOffer']
+
+        # The remote expects heartbeats at the interval it was offered, regardless of our own configuration
+        offer = state['offer']
+        self.heartbeatInterval = float(offer['heartbeat']) if 'heartbeat' in offer else None
+        self._timed = bool(self.heartbeatInterval or self._effectiveReadTimeout() or self.idleTimeout)
+
+        # Restore the message we were part way through receiving
+        self._iBufferLen, self._iType, self._iFlags, self._iHeaderComplete, headerState = state['header']
+        self._messageHeaders.setState(headerState)
+        self._iSlices = state['slices']
+        self._iSliceBytes = dict((lane, sum(len(piece) for piece in pieces)) for lane, pieces in self._iSlices.items())
+        received = state['received']
+        if self._iHeaderComplete and (self._iBufferLen > RECV_SIZE or self._spills()):
+            self._iMessage = self._messageBuffer()
+            self._iMessageView = memoryview(self._iMessage)
+            self._iMessageView[:len(received)] = received
+            self._iFilled = len(received)
+        elif received:
+            self._acquireRecvBuffer()
+            self._rBuffer[:len(received)] = received
+            self._rEnd = len(received)
+
+        self._inQueue.extend(state['inQueue'])
+        if len(self._inQueue):
+            self._parentWakeup.set()
+
+        # Restore the messages we were part way through sending, and those waiting to be sent
+        if len(state['sending']):
+            self._oBuffer.append(state['sending'])
+            self._oLength = self._oQueued = len(state['sending'])
+        for queue, frames in zip(self._outQueues, state['queued']):
+            queue.extend(frames)
+
+        self._negotiated.set()
+        self._ioWakeup.set()
+
+
     def _handshake(self):
         """
         Calls any subclassed handshake function, setting handshakeComplete upon completion, or closing
@@ -272,7 +1120,14 @@ class _Stocking(threading.Thread):
         """
 
         try:
-            self.handshakeComplete = self.handshake()
+            # A resumed connection has already completed its handshake
+            if self._resumed:
+                return
+
+            # If we've offered the remote features, wait until they've been negotiated before handshaking
+            self._negotiated.wait()
+
+            self.handshakeComplete = self.active and self.handshake()
 
             # If the handshake failed, close the connection
             if not self.handshakeComplete:
@@ -286,78 +1141,798 @@ class _Stocking(threading.Thread):
 
     def _recvMessage(self):
         """
-        Attempts to receive a message from our remote endpoint into self._iBuffer.
+        Attempts to receive messages from our remote endpoint, processing each one which is completed.
 
         Returns True if we successfully received any bytes from the remote, else False.
         """
 
-        retval = False
+        if self._tls is None:
+            return self._recvBytes()
 
-        try:
-            # If self._iBufferLen is 0 we need to recv a completed size header field
-            # to determine the length of our next incoming message
-            while not self._iBufferLen:
-                # Attempt to read a byte from the socket
-                byteRead = eintr.recv(self.sock, 1)
-
-                # If we read no bytes, return False to indicate as such
-                if not byteRead:
-                    return retval
+        # What we receive is first passed to our TLS session, which may consume it itself (during its handshake, for
+        # example) without yielding anything for us, or may yield more than fits in our buffers at once
+        if not self._tls.receive():
+            return False
 
-                # Since we've read a byte, we will return True
-                retval = True
+        while self._recvBytes():
+            pass
+
+        return not self._tls.closed
 
-                # Run what we just read through our MessageHeaders object
-                if self._messageHeaders.deserialize(byteRead):
-                    # If it returned True, we've received the message size header in its entirety.
-                    self._iBufferLen = self._messageHeaders.getLength()
-                    self._iType = self._messageHeaders.getType()
-                    self._messageHeaders.reset()
-                    break
 
-            while len(self._iBuffer) != self._iBufferLen:
-                # Attempt to recv our next incoming message into self._iBuffer
-                bytesRead = eintr.recv(self.sock, self._iBufferLen - len(self._iBuffer))
+    def _recvInto(self, buf, nbytes):
+        """
+        Receives up to nbytes from the remote into buf; from our TLS session if we have one, otherwise our socket.
+
+        Returns the number of bytes received, 0 if the remote has closed our connection, or None if there are no bytes
+        available to receive.
+        """
+
+        if self._tls is not None:
+            return self._tls.recvInto(buf, nbytes)
+
+        return eintr.recvInto(self.sock, buf, nbytes)
+
+
+    def _recvBytes(self):
+        """
+        Receives the bytes available from the remote into our buffers, processing each message which is completed.
+
+        Returns True if we successfully received any bytes from the remote, else False.
+        """
+
+        retval = False
+
+        try:
+            # If we're receiving a message too large for self._rBuffer, receive directly into its own buffer
+            if self._iMessage is not None:
+                bytesRead = self._recvInto(self._iMessageView[self._iFilled:], self._iBufferLen - self._iFilled)
                 if not bytesRead:
-                    break
+                    return retval
+
                 retval = True
-                self._iBuffer += bytesRead
-
-            # If we've completed the message in self._iBuffer, write it to self._usOut so it
-            # can be read from self._parentIn by the parent process
-            if len(self._iBuffer) == self._iBufferLen:
-                if self._iType == self._messageHeaders.UNICODE:
-                    self._iBuffer = self._iBuffer.decode('utf8')
-                if not self._usOut.closed:
-                    self._usOut.send(self._iBuffer)
-                self._iBuffer = b""
-                self._iBufferLen = 0
+                self._iFilled += bytesRead
+                for limiter in self._limiters:
+                    limiter.consume(rateLimiter.RECV, bytesRead)
+                if self._iFilled == self._iBufferLen:
+                    buf, message = self._iMessage, self._iMessageView[:self._iBufferLen]
+                    self._iMessageView.release()
+                    self._iMessage = self._iMessageView = None
+                    self._completeFrame(message, buf)
+                    self._processReceived()
+
+            else:
+                # Once everything we've received has been processed, receive into the start of our buffer again
+                if self._rStart == self._rEnd:
+                    self._rStart = self._rEnd = 0
+                if self._rBuffer is None:
+                    self._acquireRecvBuffer()
+
+                bytesRead = self._recvInto(self._rView[self._rEnd:], len(self._rBuffer) - self._rEnd)
+                if bytesRead:
+                    retval = True
+                    self._rEnd += bytesRead
+                    for limiter in self._limiters:
+                        limiter.consume(rateLimiter.RECV, bytesRead)
+                    self._processReceived()
+
+                # Return our buffer to the pool whenever we have nothing left to process, so that idle connections do
+                # not each hold one
+                if self._rStart == self._rEnd:
+                    self._releaseRecvBuffer()
 
         except socket.error as e:
             # Only mask EAGAIN errors
             if e.errno != errno.EAGAIN:
                 raise
 
+        finally:
+            if retval and self._timed:
+                self._lastRecv = time.time()
+
         return retval
 
 
-    def _sendMessage(self):
-        """ Attempts to send a message to our remote endpoint from self._oBuffer. """
+    def _acquireRecvBuffer(self):
+        """ Takes a buffer for us to receive into from the shared pool. """
+
+        self._rBuffer = bufferPool.getBufferPool().acquire(RECV_SIZE)
+        self._rView = memoryview(self._rBuffer)
+
+
+    def _releaseRecvBuffer(self):
+        """ Returns the buffer we receive into to the shared pool, if we hold one. """
+
+        if self._rBuffer is not None:
+            self._rView.release()
+            bufferPool.getBufferPool().release(self._rBuffer)
+            self._rBuffer = self._rView = None
+
+
+    def _processReceived(self):
+        """ Processes every complete message which has been received into self._rBuffer. """
+
+        while True:
+            # If we have yet to process the entire header of our next incoming message, continue doing so in order to
+            # determine its length
+            if not self._iHeaderComplete:
+                if self._rStart == self._rEnd:
+                    return
+
+                # Fixed width headers are parsed in one step once they've been received in their entirety
+                if self._iFixed:
+                    received = self._rEnd - self._rStart
+                    if received < MessageHeaders.MessageHeaders.FIXED_SIZE:
+                        # If the rest of the header will not fit into the remainder of self._rBuffer, make room for it
+                        if self._rStart + MessageHeaders.MessageHeaders.FIXED_SIZE > len(self._rBuffer):
+                            self._rBuffer[:received] = self._rView[self._rStart:self._rEnd]
+                            self._rStart, self._rEnd = 0, received
+                        return
+
+                    self._iType, self._iFlags, self._iBufferLen = \
+                        MessageHeaders.MessageHeaders.deserializeFixed(self._rBuffer, self._rStart)
+                    self._rStart += MessageHeaders.MessageHeaders.FIXED_SIZE
+                    self._iHeaderComplete = True
+
+                # When using extended framing, the message size header is followed by a byte of flags
+                elif self._iBufferLen is not None:
+                    self._iFlags = self._rBuffer[self._rStart]
+                    self._rStart += 1
+                    self._iHeaderComplete = True
+
+                else:
+                    self._rStart += self._messageHeaders.consume(self._rBuffer, self._rStart, self._rEnd)
+                    if self._messageHeaders.getLength() is None:
+                        return
+
+                    # We've received the message size header in its entirety.
+                    self._iBufferLen = self._messageHeaders.getLength()
+                    self._iType = self._messageHeaders.getType()
+                    self._iHeaderComplete = not self._iExtended
+                    self._messageHeaders.reset()
+
+                continue
+
+            # Refuse messages larger than we're willing to receive before allocating anything for them
+            if self.maxMessageSize is not None and self._iBufferLen > self.maxMessageSize:
+                self._rejectMessage()
+                return
+
+            # If we've received the entirety of the message, process it, unless it is to be spilled
+            spill = self._spills()
+            if self._rEnd - self._rStart >= self._iBufferLen and not spill:
+                start, self._rStart = self._rStart, self._rStart + self._iBufferLen
+                self._completeFrame(self._rView[start:self._rStart], None)
+                continue
+
+            # Messages to be spilled, and those which will not fit into self._rBuffer at all, are moved to a buffer of
+            # their own, into which the rest of them is received
+            if spill or self._iBufferLen > len(self._rBuffer):
+                received = min(self._rEnd - self._rStart, self._iBufferLen)
+                buf = self._messageBuffer()
+                view = memoryview(buf)
+                view[:received] = self._rView[self._rStart:self._rStart + received]
+                self._rStart += received
+                if received == self._iBufferLen:
+                    self._completeFrame(view, buf)
+                    continue
+
+                self._iMessage, self._iMessageView, self._iFilled = buf, view, received
+
+            # Otherwise if the message will not fit into the remainder of self._rBuffer, make room for it by moving
+            # what we've received of it to the start of the buffer
+            elif self._rStart + self._iBufferLen > len(self._rBuffer):
+                received = self._rEnd - self._rStart
+                self._rBuffer[:received] = self._rView[self._rStart:self._rEnd]
+                self._rStart, self._rEnd = 0, received
+
+            return
+
+
+    def _spills(self):
+        """
+        Returns a boolean indicating whether or not the message we're receiving is to be spilled to a temporary file;
+        only whole bytes messages larger than self.spillThreshold which will be delivered as they are received are.
+        """
+
+        flags = self._iFlags & (MessageHeaders.MessageHeaders.FLAG_CONTROL | MessageHeaders.MessageHeaders.FLAG_MORE |
+                                MessageHeaders.MessageHeaders.FLAG_COMPRESSED)
+        return self.spillThreshold is not None and self._iBufferLen > self.spillThreshold and not flags and \
+            self._iType == MessageHeaders.MessageHeaders.BYTES and not self._iSlices
+
+
+    def _messageBuffer(self):
+        """
+        Returns a buffer of its own to receive the message we're receiving into; a pooled buffer, or if it's to be
+        spilled, an mmap of a temporary file.
+        """
+
+        if self._spills():
+            # The file is deleted once it is closed and the mmap of it is closed in turn
+            with tempfile.TemporaryFile(dir=self.spillDirectory) as spill:
+                spill.truncate(self._iBufferLen)
+                return mmap.mmap(spill.fileno(), self._iBufferLen)
+
+        return bufferPool.getBufferPool().acquire(self._iBufferLen)
+
+
+    def _rejectMessage(self):
+        """ Closes our connection, as the remote has sent us a message larger than self.maxMessageSize. """
+
+        self._rStart = self._rEnd
+        self._signalClose()
+
+
+    def _completeFrame(self, message, buf):
+        """
+        Resets our state so that we can receive the next message from the remote, and processes a completed message.
+
+        Inputs: message - A memoryview of the message received.
+                buf     - The pooled buffer the message was received into, if it was received into a buffer of its own,
+                          else None.
+        """
 
-        # If we have no remaining bytes to send from self._oBuffer, try to move a message over from self.iBuffer
-        if not len(self._oBuffer):
-            self._oBuffer =  self._recvPipe(self._usIn) or b''
+        typ, flags = self._iType, self._iFlags
+        self._iBufferLen = None
+        self._iFlags = 0
+        self._iHeaderComplete = False
 
-        # If we have any bytes in self._oBuffer to send, attempt to do so now
-        if len(self._oBuffer):
+        self._receiveFrame(message, typ, flags, buf)
+
+
+    def _receiveFrame(self, message, typ, flags, buf=None):
+        """
+        Processes a complete message received from the remote, queueing it to be read by the parent process unless it
+        is intended for us.
+
+        Inputs: message - A memoryview of the message received.  Only valid for the duration of this call unless buf is
+                          given, in which case ownership of buf is passed to this function.
+                typ     - The type of the message; MessageHeaders.BYTES or MessageHeaders.UNICODE.
+                flags   - The flags sent with the message, if using extended framing.
+                buf     - The pooled buffer message is a view of, if it was received into a buffer of its own.
+        """
+
+        pool = bufferPool.getBufferPool()
+
+        # Compressed messages (or slices of them) are decompressed in the order they were sent
+        if flags & MessageHeaders.MessageHeaders.FLAG_COMPRESSED:
+            decompressed = self._decompress(message)
+            if buf is not None:
+                message.release()
+                pool.release(buf)
+                buf = None
+            if decompressed is None:
+                return
+            message = memoryview(decompressed)
+
+        if flags & MessageHeaders.MessageHeaders.FLAG_CONTROL:
+            self._receiveControl(message.tobytes())
+
+        # Messages which were sliced by the remote are reassembled from the slices received in their lane
+        elif flags & MessageHeaders.MessageHeaders.FLAG_MORE or self._iSlices:
+            lane = flags & MessageHeaders.MessageHeaders.FLAG_LANE_MASK
+            size = self._iSliceBytes.get(lane, 0) + len(message)
+            if self.maxMessageSize is not None and size > self.maxMessageSize:
+                self._rejectMessage()
+
+            elif flags & MessageHeaders.MessageHeaders.FLAG_MORE:
+                self._iSlices.setdefault(lane, []).append(message.tobytes())
+                self._iSliceBytes[lane] = size
+
+            else:
+                slices = self._iSlices.pop(lane, [])
+                self._iSliceBytes.pop(lane, None)
+                slices.append(message.tobytes())
+                self._deliver(memoryview(b"".join(slices)), typ, None)
+
+        # The remote's hello can only be the first message it sends us, or a reply to a hello we've sent it
+        elif self._helloExpected:
+            self._helloExpected = self._negotiating
+            if typ == MessageHeaders.MessageHeaders.BYTES and message[:len(_HELLO)].tobytes() == _HELLO:
+                self._receiveHello(message[len(_HELLO):].tobytes())
+            else:
+                self._deliver(message, typ, buf)
+                buf = None
+
+        else:
+            self._deliver(message, typ, buf)
+            buf = None
+
+        if buf is not None:
+            message.release()
+            if isinstance(buf, mmap.mmap):
+                buf.close()
+            else:
+                pool.release(buf)
+
+
+    def _deliver(self, message, typ, buf):
+        """
+        Queues a message received from the remote to be read by the parent process.
+
+        Inputs: message - A memoryview of the message received.
+                typ     - The type of the message; MessageHeaders.BYTES or MessageHeaders.UNICODE.
+                buf     - The pooled buffer (or mmap, if the message was spilled) message is a view of if we own it, else
+                          None.  Ownership of buf is passed to this function.
+        """
+
+        pool = bufferPool.getBufferPool()
+
+        if self.capture is not None:
+            self._captureMessage(capture.CAPTURE_RECEIVED, message, typ == MessageHeaders.MessageHeaders.BYTES)
+
+        # Messages spilled to temporary files are delivered as the mmap they were received into
+        if isinstance(buf, mmap.mmap):
+            message.release()
+            toDeliver, buf = buf, None
+
+        elif typ == MessageHeaders.MessageHeaders.UNICODE:
+            toDeliver = codecs.utf_8_decode(message, 'strict', True)[0]
+
+        # When lending our buffers, the message must be in a buffer of its own which is passed on to our parent
+        elif self.borrowBuffers:
+            if buf is None:
+                buf = pool.acquire(len(message))
+                buf[:len(message)] = message
+                message = memoryview(buf)[:len(message)]
+            toDeliver, buf = message, None
+
+        else:
+            toDeliver = message.tobytes()
+
+        if buf is not None:
+            message.release()
+            pool.release(buf)
+
+        if self.idleTimeout:
+            self._lastActivity = time.time()
+
+        for limiter in self._limiters:
+            limiter.consume(rateLimiter.RECV, 0, 1)
+
+        self._inQueue.append(toDeliver)
+        self._parentWakeup.set()
+
+
+    def _captureMessage(self, direction, message, isBytes):
+        """
+        Records a message sent or received to self.capture.
+
+        Inputs: direction - CAPTURE_SENT or CAPTURE_RECEIVED.
+                message   - The message, encoded as bytes or a memoryview.
+                isBytes   - Whether the message is a bytes message, rather than a string/unicode one.
+        """
+
+        typ = MessageHeaders.MessageHeaders.BYTES if isBytes else MessageHeaders.MessageHeaders.UNICODE
+        self.capture.record(self._captureStream, direction, typ, message)
+
+
+    def _compress(self, frame):
+        """
+        Compresses a frame using our compression stream.  Must be called in the order frames are sent to the remote.
+
+        Inputs: frame - A frame, as returned by _frame, or a slice of one.
+
+        Outputs: A frame containing the compressed message.
+        """
+
+        msg = frame[3]
+        start = _cpuTime()
+        compressed = self._compressor.compress(msg) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+        stats = self._compressStats
+        stats[0] += 1
+        stats[1] += len(msg)
+        stats[2] += len(compressed)
+        stats[3] += _cpuTime() - start
+
+        return (frame[0], frame[1], None, compressed)
+
+
+    def _decompress(self, message):
+        """
+        Decompresses a message received from the remote using our decompression stream, creating it if need be.
+
+        Inputs: message - A memoryview of the compressed message.
+
+        Outputs: The decompressed message, as bytes, or None if it was larger than self.maxMessageSize, in which case
+                 our connection has been closed.
+        """
+
+        if self._decompressor is None:
+            self._decompressor = zlib.decompressobj()
+
+        start = _cpuTime()
+        if self.maxMessageSize is None:
+            decompressed = self._decompressor.decompress(message)
+
+        # Never decompress more than we're willing to receive
+        else:
+            decompressed = self._decompressor.decompress(message, self.maxMessageSize + 1)
+            if len(decompressed) > self.maxMessageSize:
+                self._rejectMessage()
+                return None
+
+        stats = self._decompressStats
+        stats[0] += 1
+        stats[1] += len(decompressed)
+        stats[2] += len(message)
+        stats[3] += _cpuTime() - start
+
+        return decompressed
+
+
+    def _receiveControl(self, message):
+        """
+        Processes a control message received from the remote.
+
+        Inputs: message - The control message received, as bytes.
+        """
+
+        # Heartbeats require no action; simply having received them keeps the connection alive
+        if message == _CONTROL_HEARTBEAT:
+            return
+
+
+    def _receiveHello(self, encodedOffer):
+        """
+        Processes the hello received from the remote, completing our negotiation of features with it.  From this
+        point on both we and the remote use extended framing.
+
+        Inputs: encodedOffer - The features offered by the remote, encoded as bytes.
+        """
+
+        # If we've not sent the remote a hello of our own, do so now so that it stops waiting on one
+        if not self._offered:
+            self._offered = True
+            self._bufferFrame(self._frame(_HELLO + self._encodeOffer(self._offer())))
+            self._oDeadline = 0
+
+        self._peerOffer = self._decodeOffer(encodedOffer)
+        self._iExtended = self._oExtended = True
+        self._accept(self._peerOffer)
+        self._endNegotiation()
+
+        if self._timed:
+            self._armTimer()
+
+
+    def _expireNegotiation(self):
+        """ Called from the shared TimerWheel once the remote has taken too long to reply to our hello. """
+
+        self._negotiationExpired = True
+        self._ioWakeup.set()
+
+
+    def _endNegotiation(self):
+        """ Called by our thread once we are no longer negotiating features with the remote. """
+
+        self._negotiating = self._helloExpected = False
+        if self._negotiationTimer is not None:
+            timerWheel.getTimerWheel().cancel(self._negotiationTimer)
+            self._negotiationTimer = None
+        self._negotiated.set()
+        # Wake ourselves up to send any messages which were held back during the negotiation
+        self._ioWakeup.set()
+
+
+    def _effectiveReadTimeout(self):
+        """
+        Returns the number of seconds without receiving anything from the remote after which we will close, or None.
+        If not configured, defaults to HEARTBEAT_MISSES of the remote's heartbeat interval if it has offered them.
+        """
+
+        if self.readTimeout:
+            return self.readTimeout
+
+        if self._peerOffer and 'heartbeat' in self._peerOffer:
+            return float(self._peerOffer['heartbeat']) * HEARTBEAT_MISSES
+
+
+    def _checkTimers(self):
+        """
+        Sends the remote a heartbeat if one is due, and closes our connection if any of our timeouts have elapsed.
+
+        Outputs: The number of seconds until we next need to check our timers, or None if we need not.
+        """
+
+        now = time.time()
+        deadlines = []
+
+        for timeout, last in ((self._effectiveReadTimeout(), self._lastRecv), (self.idleTimeout, self._lastActivity)):
+            if timeout:
+                if now - last >= timeout:
+                    self._signalClose()
+                    return None
+                deadlines.append(last + timeout)
+
+        # Heartbeats can only be sent once the remote has agreed to use extended framing
+        if self.heartbeatInterval and self._oExtended:
+            if now - self._lastSent >= self.heartbeatInterval:
+                self._lastSent = now
+                self._queueFrame(_HEARTBEAT, PRIORITY_HIGH)
+            deadlines.append(self._lastSent + self.heartbeatInterval)
+
+        if deadlines:
+            return max(0, min(deadlines) - now)
+
+
+    def _armTimer(self):
+        """
+        Checks our timers, and schedules a call to this function on the shared TimerWheel for when they next need to
+        be checked.
+        """
+
+        def __armTimer(self):
+            wheel = timerWheel.getTimerWheel()
+            if self._timer is not None:
+                wheel.cancel(self._timer)
+                self._timer = None
+
+            if self.active:
+                delay = self._checkTimers()
+                if delay is not None and self.active:
+                    self._timer = wheel.schedule(delay, self._armTimer)
+
+        self._runLocked(__armTimer, self)
+
+
+    def _sendDue(self):
+        """
+        Returns a boolean indicating whether or not the contents of self._oBuffer (or data encrypted by our TLS session)
+        should be sent now.
+        """
+
+        # Our TLS session's own data is always due, while nothing else can be sent until its handshake has completed
+        if self._tls is not None:
+            if self._tls.pending():
+                return True
+            if not self._tls.established:
+                return False
+
+        return bool(self._oLength) and (
+            not self._oDeadline or self._oLength >= self.coalesceSize or self._oDeadline <= time.time()
+        )
+
+
+    def _sendTimeout(self):
+        """
+        Returns the number of seconds until messages being coalesced in self._oBuffer must be sent, or None if there
+        are no messages being held back.
+        """
+
+        if self._oLength and self._oDeadline:
+            return max(0, self._oDeadline - time.time())
+
+
+    def _throttle(self, direction):
+        """
+        Returns the number of seconds until our rate limits allow traffic in the given direction (rateLimiter.SEND or
+        rateLimiter.RECV) to flow again, or 0 if they allow it to flow now.
+        """
+
+        if not self._limiters:
+            return 0
+
+        now = time.time()
+        return max(limiter.delay(direction, now) for limiter in self._limiters)
+
+
+    def _setBusyPoll(self):
+        """
+        Asks the kernel to busy poll for packets for up to self.busyPoll seconds when receiving from our socket would
+        block, where it supports doing so.  Only applies to TCP sockets, and is silently skipped where not permitted.
+        """
+
+        if _SO_BUSY_POLL is None or self.sock.family not in (socket.AF_INET, getattr(socket, 'AF_INET6', None)):
+            return
+
+        try:
+            self.sock.setsockopt(socket.SOL_SOCKET, _SO_BUSY_POLL, max(1, int(self.busyPoll * 1000000)))
+
+        except socket.error:
+            pass
+
+
+    def _busyWait(self, poll, timeout, ready=bool):
+        """
+        Waits for I/O by spinning on polls which do not sleep for up to self.busyPoll seconds, before falling back to a
+        poll which sleeps for whatever remains of timeout.  Used by our thread in place of sleeping straight away.
+
+        Inputs: poll    - A function taking a timeout in seconds (or None to wait indefinitely) and returning the
+                          result of polling for I/O.
+                timeout - The maximum number of seconds to wait, or None to wait indefinitely.
+                ready   - A function returning whether or not a result of poll reported any I/O.
+
+        Outputs: The result of the last call to poll.
+        """
+
+        start = time.time()
+        spinUntil = start + (self.busyPoll if timeout is None else min(self.busyPoll, timeout))
+
+        while True:
+            result = poll(0)
+            now = time.time()
+            if ready(result) or now >= spinUntil or not self.active:
+                break
+            _yield()
+
+        if ready(result) or not self.active:
+            return result
+
+        if timeout is not None:
+            timeout -= now - start
+            if timeout <= 0:
+                return result
+
+        return poll(timeout)
+
+
+    def _ioTimeout(self):
+        """
+        Returns the number of seconds until our thread must next wake up; to send messages being coalesced, or once our
+        rate limits allow us to resume sending or receiving.  Returns None if it need not wake up until there is I/O.
+        """
+
+        timeout = self._sendTimeout()
+        if self._limiters:
+            delays = [self._throttle(rateLimiter.RECV)]
+            if self._framesQueued():
+                delays.append(self._throttle(rateLimiter.SEND))
+            for delay in delays:
+                if delay and (timeout is None or delay < timeout):
+                    timeout = delay
+
+        return timeout
+
+
+    def _sendMessage(self):
+        """ Attempts to send messages to our remote endpoint from self._oBuffer, until our socket would block. """
+
+        coalescing = self.sendPolicy == SEND_COALESCE
+
+        # If the remote has taken too long to reply to our hello, assume it does not support negotiating features
+        if self._negotiating and self._negotiationExpired:
+            self._endNegotiation()
+
+        while True:
+            # Try to move messages over from self._outQueues into self._oBuffer, highest priority first.  Unless we're
+            # coalescing writes, we only move a message over once the previous one has been sent in its entirety.
+            # While negotiating features with the remote, messages are held back until we know how to frame them.
+            self._oFraming = True
+            while not self._negotiating and (
+                not self._oLength or (coalescing and self._oLength < self.coalesceSize)
+            ):
+                # Once our rate limits have been reached, hold back further messages until they allow more
+                if self._limiters and self._throttle(rateLimiter.SEND):
+                    break
+
+                nextFrame = self._nextFrame()
+                if nextFrame is None:
+                    break
+                frame, flags = nextFrame
+
+                # Our parent has asked us to flush anything we've been holding back
+                if frame is _FLUSH:
+                    self._oDeadline = 0
+                    continue
+
+                # Our parent has asked to be told once everything queued before this point has been sent
+                if not isinstance(frame, tuple):
+                    self._oCallbacks.append((self._oQueued, frame))
+                    self._completeSends()
+                    continue
+
+                if self.idleTimeout and not frame[1]:
+                    self._lastActivity = time.time()
+
+                if self._compressor is not None and not frame[1] and len(frame[3]) >= self.compressionThreshold:
+                    frame = self._compress(frame)
+                    flags |= MessageHeaders.MessageHeaders.FLAG_COMPRESSED
+
+                # Control messages are not subject to our rate limits; slices count towards the message limit once
+                if self._limiters and not frame[1]:
+                    messages = 0 if flags & MessageHeaders.MessageHeaders.FLAG_MORE else 1
+                    for limiter in self._limiters:
+                        limiter.consume(rateLimiter.SEND, len(frame[3]), messages)
+
+                if not self._oLength:
+                    self._oDeadline = (time.time() + self.coalesceDelay) if coalescing else 0
+                self._bufferFrame(frame, flags)
+            self._oFraming = False
+
+            # If we have no bytes in self._oBuffer which are due to be sent, there's nothing more for us to do
+            if not self._sendDue():
+                # If our parent is waiting on us to send everything queued and we have, let it know
+                if self._draining and not self._oLength and not self._framesQueued():
+                    self._draining = False
+                    self._drained.set()
+                return
+
+            # Once we've begun sending, continue doing so until self._oBuffer is empty
+            self._oDeadline = 0
             try:
-                bytesSent = self.sock.send(self._oBuffer)
-                self._oBuffer = self._oBuffer[bytesSent:]
+                sentAll = self._sendBuffered()
+                if self._timed:
+                    self._lastSent = time.time()
 
             except socket.error as e:
                 # Only mask EAGAIN errors
                 if e.errno != errno.EAGAIN:
                     raise
+                return
+
+            self._completeSends()
+
+            # If we were unable to send everything we tried to, our socket's buffer is full
+            if not sentAll:
+                return
+
+
+    def _sendBuffered(self):
+        """
+        Sends as many segments from the front of self._oBuffer as the socket will accept; many at once using sendmsg
+        where it is supported.  When using TLS, segments are instead passed to our TLS session to be encrypted and sent.
+
+        Outputs: A boolean indicating whether or not every byte which we attempted to send was sent.
+        """
+
+        if self._tls is not None:
+            segments = list(itertools.islice(self._oBuffer, _MAX_SEGMENTS))
+            attempted = sum(len(segment) for segment in segments)
+            bytesSent = self._tls.send(segments)
+
+        elif _SENDMSG and len(self._oBuffer) > 1:
+            segments = list(itertools.islice(self._oBuffer, _MAX_SEGMENTS))
+            attempted = sum(len(segment) for segment in segments)
+            bytesSent = self.sock.sendmsg(segments)
+
+        else:
+            # Without sendmsg, join our segments so that coalesced messages are still sent together
+            if len(self._oBuffer) > 1:
+                joined = b"".join(self._oBuffer)
+                self._oBuffer.clear()
+                self._oBuffer.append(joined)
+            attempted = len(self._oBuffer[0])
+            bytesSent = self.sock.send(self._oBuffer[0])
+
+        self._oLength -= bytesSent
+        self._oSent += bytesSent
+
+        # Remove the segments which were sent, keeping a view of the remainder of any which was only partially sent
+        remaining = bytesSent
+        while remaining:
+            segment = self._oBuffer[0]
+            if len(segment) <= remaining:
+                remaining -= len(segment)
+                self._oBuffer.popleft()
+            else:
+                self._oBuffer[0] = memoryview(segment)[remaining:]
+                remaining = 0
+
+        # Our TLS session holds on to whatever it encrypted which our socket would not accept
+        return bytesSent == attempted and not (self._tls is not None and self._tls.pending())
+
+
+    def _completeSends(self):
+        """ Calls the callbacks of every message which has been sent in its entirety. """
+
+        while len(self._oCallbacks) and self._oCallbacks[0][0] <= self._oSent:
+            self._callback(self._oCallbacks.popleft()[1], True)
+
+
+    @staticmethod
+    def _callback(callback, sent):
+        """
+        Calls a callback passed to write, printing rather than raising any exception it raises so that it does not
+        kill our thread.
+        """
+
+        try:
+            callback(sent)
+
+        except Exception:
+            traceback.print_exc()
 
 
     # Subclass Overrides
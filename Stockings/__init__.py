@@ -22,8 +22,15 @@
 import select
 
 # Project imports
+from ._Stocking import SEND_DEFAULT, SEND_NODELAY, SEND_COALESCE, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
 from ._pollStocking import PollStocking
 from ._selectStocking import SelectStocking
+from ._broadcast import broadcast, BROADCAST_QUEUE, BROADCAST_SKIP, BROADCAST_DROP
+from ._selector import StockingSelector
+from ._handoff import sendStocking, recvStocking
+from .utils.capture import CaptureWriter, readCapture, CAPTURE_SENT, CAPTURE_RECEIVED
+from .utils.rateLimiter import RateLimiter
+from .utils.tls import SessionCache
 from .exceptions.notReady import NotReady
 
 # Depending on whether or not we have poll support, set the appropriate module as `Stocking`
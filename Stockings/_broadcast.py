@@ -0,0 +1,87 @@
+"""
+    This file is part of Stockings.
+
+    Stockings is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Stockings is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Stockings.  If not, see <http://www.gnu.org/licenses/>.
+
+
+    Author: Warren Spencer
+    Email:  warrenspencer27@gmail.com
+"""
+
+# Project imports
+from ._Stocking import PRIORITY_NORMAL
+
+# Globals
+
+# Slow subscriber policies.  A subscriber is considered slow if it still has data queued to be sent to its remote.
+BROADCAST_QUEUE = 'queue' # Queue the message regardless, behaving as if `write` were called on each Stocking
+BROADCAST_SKIP = 'skip'   # Do not queue the message for slow subscribers
+BROADCAST_DROP = 'drop'   # Close slow subscribers
+
+
+def broadcast(stockings, message, policy=BROADCAST_QUEUE, priority=PRIORITY_NORMAL):
+    """
+    Sends a single message to many Stockings at once.
+
+    The message is passed through each Stocking's preWrite (which may depend on the state of the Stocking), and framed
+    once for each distinct result; the resulting buffer is shared between every Stocking it is queued on.  Classes
+    setting broadcastSafe declare that their preWrite depends only on its arguments, and it is then called only once
+    per class.
+
+    Stockings which are closed or which have not yet completed their handshake are skipped, as are those which cannot
+    send the message because it is too long for the fixed width headers they use.
+
+    Inputs: stockings - An iterable of Stockings to send the message to.
+            message   - The message to send; passed as the only argument to each Stocking's preWrite.
+            policy    - One of BROADCAST_QUEUE, BROADCAST_SKIP or BROADCAST_DROP, describing how to treat Stockings
+                        which still have data waiting to be sent to their remote.
+            priority  - The priority to send the message with; one of PRIORITY_HIGH, PRIORITY_NORMAL or PRIORITY_LOW.
+
+    Outputs: A list of the Stockings the message was queued on.
+    """
+
+    if policy not in (BROADCAST_QUEUE, BROADCAST_SKIP, BROADCAST_DROP):
+        raise ValueError("Unknown broadcast policy: %r" % (policy,))
+
+    # Frames of the messages returned by preWrite, keyed by the Stocking class if it's broadcastSafe, otherwise by the
+    # identity of the message; which is held alongside its frame so that it cannot be reused by another message
+    frames = {}
+    sentTo = []
+
+    for stocking in stockings:
+        if not (stocking.active and stocking.handshakeComplete):
+            continue
+
+        if policy != BROADCAST_QUEUE and stocking.writeDataQueued():
+            if policy == BROADCAST_DROP:
+                stocking.close()
+            continue
+
+        typ = type(stocking)
+        if typ.broadcastSafe and typ in frames:
+            frame = frames[typ][1]
+
+        else:
+            msg = stocking.preWrite(message)
+            key = typ if typ.broadcastSafe else id(msg)
+            if key not in frames:
+                frame = stocking._frame(msg)
+                frames[key] = (msg, frame if len(frame[3]) else None)
+            frame = frames[key][1]
+
+        if frame is not None and stocking._canSend(frame):
+            stocking._queueFrame(frame, priority)
+            sentTo.append(stocking)
+
+    return sentTo
@@ -0,0 +1,107 @@
+"""
+    This file is part of Stockings.
+
+    Stockings is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Stockings is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Stockings.  If not, see <http://www.gnu.org/licenses/>.
+
+
+    Author: Warren Spencer
+    Email:  warrenspencer27@gmail.com
+"""
+
+# Standard imports
+import socket, struct, array, pickle, os
+
+# Globals
+
+# Header preceding the pickled state of each Stocking sent over a channel; its length
+_LENGTH = struct.Struct('!Q')
+
+
+def sendStocking(channel, stocking, data=None, timeout=None):
+    """
+    Hands a Stocking's connection to another process, which resumes it using recvStocking.  The Stocking is detached
+    (see Stocking.detach), its socket is sent over the channel along with the state of its connection, and it is closed.
+
+    Inputs: channel  - A connected, blocking Unix domain socket, whose remote end is passed to recvStocking.
+            stocking - The Stocking to hand on.  Must have completed its handshake.
+            data     - Any picklable object to send along with the Stocking; for example any attributes set on it by its
+                       handshake, which are not otherwise handed on.
+            timeout  - The maximum number of seconds to wait for the Stocking's thread to stop, or None to wait
+                       indefinitely.
+    """
+
+    # Data which cannot be pickled is refused before our Stocking is detached, while it can still be used
+    data = pickle.dumps(data, pickle.HIGHEST_PROTOCOL)
+    state = stocking.detach(timeout)
+
+    # Once detached, our Stocking can no longer be used; its socket is closed even if it cannot be handed on
+    try:
+        payload = pickle.dumps((state, data), pickle.HIGHEST_PROTOCOL)
+
+        # The socket is passed as ancillary data alongside the length of the state which follows
+        fds = array.array('i', [stocking.sock.fileno()])
+        channel.sendmsg([_LENGTH.pack(len(payload))], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, fds)])
+        channel.sendall(payload)
+
+    finally:
+        stocking.sock.close()
+        stocking.close()
+
+
+def recvStocking(channel, stockingClass=None, **options):
+    """
+    Receives a Stocking's connection handed on by another process using sendStocking, and resumes it.
+
+    Note: The state of the connection is unpickled, so the channel must only be connected to trusted processes.
+
+    Inputs: channel       - A connected, blocking Unix domain socket, whose remote end is passed to sendStocking.
+            stockingClass - The class of Stocking to resume the connection with; by default Stockings.Stocking.
+            options       - Keyword arguments passed on to the Stocking; see Stocking.__init__.
+
+    Outputs: A tuple containing the resumed Stocking, and the data sent along with it.
+    """
+
+    if stockingClass is None:
+        from . import Stocking as stockingClass
+
+    header, fds = b'', array.array('i')
+    while len(header) < _LENGTH.size:
+        received, ancillary, _, _ = channel.recvmsg(_LENGTH.size - len(header), socket.CMSG_SPACE(fds.itemsize))
+        if not received:
+            raise EOFError("Channel closed while receiving a Stocking")
+
+        header += received
+        for level, typ, cmsgData in ancillary:
+            if level == socket.SOL_SOCKET and typ == socket.SCM_RIGHTS:
+                fds.frombytes(cmsgData[:len(cmsgData) - (len(cmsgData) % fds.itemsize)])
+
+    length = _LENGTH.unpack(header)[0]
+    chunks = []
+    while length:
+        chunk = channel.recv(min(length, 2**20))
+        if not chunk:
+            raise EOFError("Channel closed while receiving a Stocking")
+        chunks.append(chunk)
+        length -= len(chunk)
+
+    if len(fds) != 1:
+        for fd in fds:
+            os.close(fd)
+        raise ValueError("Expected a single socket to be received, got %d" % len(fds))
+
+    state, data = pickle.loads(b"".join(chunks))
+    data = pickle.loads(data)
+    sock = socket.socket(state['family'], state['type'], 0, fds[0])
+
+    return stockingClass(sock, _resumeState=state, **options), data
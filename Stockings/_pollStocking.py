@@ -24,30 +24,93 @@ import socket, errno, threading, select
 
 # Project imports
 from ._Stocking import _Stocking
+from .utils import rateLimiter
+
+# Globals
+
+# Whether or not epoll is available; where it is, it's used in place of select.poll.  Its event flags share the values
+# of their select.poll equivalents, so the POLL constants are used for both.
+_EPOLL = hasattr(select, 'epoll')
+
+# Events our socket is registered for when using edge triggered notifications; these are never changed
+_EDGE_EVENTS = (select.POLLIN | select.POLLOUT | select.EPOLLET) if _EPOLL else None
+
+# Events which indicate that our socket should be received from; we discover why once we try
+_READ_EVENTS = select.POLLIN | select.POLLHUP | select.POLLERR
 
 class PollStocking(_Stocking):
     """
     Class which handles a connection with a remote endpoint.  Runs as a thread and can be interfaced with
     by using its `read` and `write` functions to read and write complete messages to a remote endpoint.
 
-    Uses the select.poll construct to manage its pipes/sockets I/O.
+    Uses epoll to manage its pipes/sockets I/O where it is available, otherwise the select.poll construct.
     """
 
     # Internal attributes
-    _poller = None            # select.poll object used to manage I/O activity.
+    _poller = None            # select.epoll or select.poll object used to manage I/O activity.
+    _sockFd = None            # File descriptor of self.sock
+    _wakeupFd = None          # File descriptor of self._ioWakeup
+    _eventMask = 0            # Events self._sockFd is currently registered for
+    _edge = False             # Whether or not our socket is registered for edge triggered notifications
+    _sockReadable = False     # When edge triggered, whether or not our socket may have bytes left to receive
+
+    def _pollRegister(self):
+        """ Updates the events we poll our socket for, if they have changed. """
+
+        # Edge triggered notifications are received for every event, and never need changing
+        if self._edge:
+            return
+
+        # If we were unable to write the entirety of the message to the socket, poll on it being writeable.
+        # If the message is being held back while coalescing writes, we will instead be woken by our poll timing out.
+        eventMask = select.POLLOUT if self._sendDue() else 0
+
+        # Unless our rate limits have been reached, in which case we are woken by our poll timing out once they allow us
+        # to receive again, poll on our socket being readable
+        if not (self._limiters and self._throttle(rateLimiter.RECV)):
+            eventMask |= select.POLLIN
+
+        # Only changes to the events cost a system call
+        if eventMask != self._eventMask:
+            self._eventMask = eventMask
+            self._poller.modify(self._sockFd, eventMask)
+
 
-    def _pollSendMessage(self):
-        """ Attempts to send a message to our remote endpoint from self._oBuffer. """
+    def _poll(self, timeout):
+        """ Waits up to timeout seconds (or indefinitely if None) for events, returning a list of (fd, events). """
 
-        self._sendMessage()
+        if _EPOLL:
+            return self._poller.poll(-1 if timeout is None else timeout)
 
-        # If we were unable to write the entirety of the message to the socket, poll on it being writeable
-        if len(self._oBuffer):
-            self._poller.register(self.sock, select.POLLIN | select.POLLOUT)
+        return self._poller.poll(None if timeout is None else timeout * 1000)
 
-        # Otherwise self._oBuffer is empty; disable polling on our socket being writeable
-        else:
-            self._poller.register(self.sock, select.POLLIN)
+
+    def _drainSocket(self):
+        """
+        Receives from our socket until it has nothing left to receive, as is required when using edge triggered
+        notifications, or until our rate limits have been reached.
+
+        Outputs: False if the remote has closed our connection, otherwise True.
+        """
+
+        while self._sockReadable:
+            # Once our rate limits allow it, we're woken by our poll timing out to continue receiving
+            if self._limiters and self._throttle(rateLimiter.RECV):
+                return True
+
+            if not self._recvMessage():
+                # Receiving nothing means either the remote has closed our connection, or that we've received
+                # everything available; which is discovered without consuming anything
+                try:
+                    if not self.sock.recv(1, socket.MSG_PEEK):
+                        return False
+
+                except socket.error as e:
+                    if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                        raise
+                    self._sockReadable = False
+
+        return True
 
 
     # Threading.Thread override
@@ -60,41 +123,64 @@ class PollStocking(_Stocking):
 
             with self._ioLock:
                 if self.active:
-                    self._poller = select.poll()
-                    # Detect if we've been closed by our parent
-                    self._poller.register(self._parentIn, select.POLLHUP)
+                    self._sockFd = self.sock.fileno()
+                    self._wakeupFd = self._ioWakeup.fileno()
+                    # Our TLS session decides for itself how much to receive, so cannot drain our socket as required
+                    # when edge triggered
+                    self._edge = self.edgeTriggered and _EPOLL and self._tls is None
+                    self._poller = select.epoll() if _EPOLL else select.poll()
                     # Detect messages to recv from the remote endpoint
-                    self._poller.register(self.sock, select.POLLIN)
-                    # Detect messages to send from our parent
-                    self._poller.register(self._usIn, select.POLLIN)
-
-            while self.active:
-                # Wait until we have input or output to act upon
-                for fd, eventMask in self._poller.poll():
-                    # eventMask will be POLLIN if we have data to process
-                    if eventMask & select.POLLIN:
-                        # If our socket was returned, there is data for us to recv
-                        if self.sock.fileno() == fd:
-                            # If our connected socket to the remote is in the list of readable sockets we expect that
-                            # we can read from it; if for some reason we cannot we can assume we have become disconnected.
-                            if not self._recvMessage():
-                                return
-
-                        # Otherwise check if our parent sent us data
-                        elif not self._usIn.closed and self._usIn.fileno() == fd:
-                            self._pollSendMessage()
-
-                    # eventmask will be POLLOUT if we can continue sending data from self._oBuffer
-                    elif eventMask & select.POLLOUT:
-                        self._pollSendMessage()
-
-                    # Otherwise check if our parent has asked us to close
-                    elif eventMask & select.POLLHUP:
+                    self._eventMask = _EDGE_EVENTS if self._edge else select.POLLIN
+                    self._poller.register(self._sockFd, self._eventMask)
+                    # Detect messages to send from our parent, or our parent asking us to close
+                    self._poller.register(self._wakeupFd, select.POLLIN)
+
+            while self.active and not self._detaching:
+                # Wait until we have input or output to act upon, or until messages being coalesced must be sent;
+                # spinning for a time first if we're busy polling
+                if self.busyPoll:
+                    events = self._busyWait(self._poll, self._ioTimeout())
+                else:
+                    events = self._poll(self._ioTimeout())
+
+                # Every event returned is gathered before acting upon any, so that we receive, send and update the
+                # events we poll for at most once each per poll
+                recv = send = False
+                for fd, eventMask in events:
+                    if fd == self._sockFd:
+                        recv |= bool(eventMask & _READ_EVENTS)
+                        send |= bool(eventMask & select.POLLOUT)
+
+                    # Otherwise our parent sent us data
+                    elif fd == self._wakeupFd:
+                        # Our parent may have woken us because we've been closed
+                        if not self.active:
+                            return
+                        self._ioWakeup.clear()
+                        send = True
+
+                if recv:
+                    # If our connected socket to the remote is readable we expect that we can read from it; if for some
+                    # reason we cannot we can assume we have become disconnected.
+                    if self._edge:
+                        self._sockReadable = True
+                    elif not self._recvMessage():
                         return
 
+                # When edge triggered we continue receiving until there's nothing left, even after being throttled
+                if self._sockReadable and not self._drainSocket():
+                    return
+
+                # If our poll timed out, messages being coalesced or held back by our rate limits may now be due
+                if send or not events:
+                    self._sendMessage()
+
+                self._pollRegister()
+
         except socket.error as e:
-            # Ignore bad file descriptor & connection reset/abort errors
-            if e.errno not in (errno.EBADF, errno.ECONNRESET, errno.ECONNABORTED):
+            # Ignore bad file descriptor & connection reset/abort errors, and our socket having been closed and
+            # replaced by another file before we could stop polling on it
+            if e.errno not in (errno.EBADF, errno.ECONNRESET, errno.ECONNABORTED, errno.ENOENT):
                 raise
 
         except select.error as e:
@@ -103,4 +189,6 @@ class PollStocking(_Stocking):
                 raise
 
         finally:
-            self._signalClose()
+            if _EPOLL and self._poller is not None:
+                self._poller.close()
+            self._teardown()
@@ -24,6 +24,7 @@ import socket, errno, threading, select, os
 
 # Project imports
 from ._Stocking import _Stocking
+from .utils import rateLimiter
 
 # Globals
 
@@ -49,23 +50,45 @@ class SelectStocking(_Stocking):
             handshakeThread = threading.Thread(target=self._handshake)
             handshakeThread.start()
 
-            while self.active:
+            while self.active and not self._detaching:
                 selectWrite = []
-                # We always want to be interrupted when we can read from our socket
-                selectRead = [self.sock]
-                # If we have data that we need to send, interrupt when we can write to our socket
-                if len(self._oBuffer) or self._checkReadablePipe(self._usIn):
+                # We always want to be interrupted when our parent has data for us to send, and when we can read from
+                # our socket unless our rate limits have been reached
+                selectRead = [self._ioWakeup]
+                if not (self._limiters and self._throttle(rateLimiter.RECV)):
+                    selectRead.append(self.sock)
+                # If we have data that we need to send (and our rate limits allow it), interrupt when we can write to
+                # our socket
+                throttled = self._limiters and self._throttle(rateLimiter.SEND)
+                if self._sendDue() or (self._framesQueued() and not throttled):
                     selectWrite.append(self.sock)
 
-                # Wait until we have input or output to act upon
+                # If messages are being held back while coalescing writes or by our rate limits, wake up when they
+                # must be sent
+                timeout = self._ioTimeout()
+                if timeout is None or timeout > SEND_INTERVAL:
+                    timeout = SEND_INTERVAL
+
+                # Wait until we have input or output to act upon, spinning for a time first if we're busy polling
                 try:
-                    readable, writable, _ = select.select(selectRead, selectWrite, [], SEND_INTERVAL)
+                    if self.busyPoll:
+                        readable, writable, _ = self._busyWait(
+                            lambda timeout: select.select(selectRead, selectWrite, [], timeout), timeout,
+                            lambda result: result[0] or result[1]
+                        )
+                    else:
+                        readable, writable, _ = select.select(selectRead, selectWrite, [], timeout)
 
                 except ValueError:
                     # This is typically caused by our socket being closed when we go into the select.
                     # If this happens, break out and close our connection
                     break
 
+                # If our parent has sent us data, it will be sent below
+                if self._ioWakeup in readable:
+                    readable.remove(self._ioWakeup)
+                    self._ioWakeup.clear()
+
                 # If we have data to receive, receive it
                 if readable:
                     # If our connected socket to the remote is in the list of readable sockets we expect that
@@ -74,7 +97,7 @@ class SelectStocking(_Stocking):
                         return
 
                 # If we have data to send, send it
-                if writable or len(self._oBuffer) or self._checkReadablePipe(self._usIn):
+                if writable or self._oLength or self._framesQueued():
                     self._sendMessage()
 
         except socket.error as e:
@@ -88,4 +111,4 @@ class SelectStocking(_Stocking):
                 raise
 
         finally:
-            self._signalClose()
+            self._teardown()
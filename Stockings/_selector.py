@@ -0,0 +1,188 @@
+"""
+    This file is part of Stockings.
+
+    Stockings is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Stockings is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Stockings.  If not, see <http://www.gnu.org/licenses/>.
+
+
+    Author: Warren Spencer
+    Email:  warrenspencer27@gmail.com
+"""
+
+# Standard imports
+import select, time, threading
+
+try:
+    import selectors
+except ImportError:
+    selectors = None
+
+# Globals
+
+# Number of seconds between checks on whether Stockings which are still handshaking have completed their handshakes
+HANDSHAKE_INTERVAL = .01
+
+
+class StockingSelector(object):
+    """
+    Class allowing a single thread to wait on messages from many Stockings at once.
+
+    Note: Uses the most efficient mechanism provided by the selectors module (for example epoll on Linux) where it is
+          available, otherwise falls back to select.select.
+    """
+
+    _selector = None          # selectors.BaseSelector used to wait on our Stockings; created when first needed
+    _stockings = None         # Dictionary mapping the filenos of our Stockings to the Stockings
+    _handshaking = None       # Dictionary mapping the filenos of our Stockings which are still handshaking to the
+                              # Stockings; these are not waited on until their handshakes complete
+
+    def __init__(self):
+        self._stockings = {}
+        self._handshaking = {}
+
+
+    # Data Model functions
+    def __len__(self):
+        return len(self._stockings)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, typ, value, tb):
+        self.close()
+
+
+    # API functions
+    def register(self, stocking):
+        """
+        Begins waiting on messages from the given Stocking.  Messages received during a Stocking's handshake are
+        consumed by the handshake itself, so a Stocking which is still handshaking is only waited on once it completes.
+        """
+
+        self._stockings[stocking.fileno()] = stocking
+        if stocking.active and not stocking.handshakeComplete:
+            self._handshaking[stocking.fileno()] = stocking
+        else:
+            self._watch(stocking)
+
+
+    def unregister(self, stocking):
+        """
+        Stops waiting on messages from the given Stocking.  Stockings should be unregistered before being closed by
+        their parent, as closing a Stocking closes its fileno.
+        """
+
+        fileno = stocking.fileno()
+        self._handshaking.pop(fileno, None)
+        if self._stockings.pop(fileno, None) is not None and self._selector is not None:
+            try:
+                self._selector.unregister(fileno)
+
+            except (KeyError, ValueError):
+                pass
+
+
+    def select(self, timeout=None, maxMessages=None):
+        """
+        Waits until at least one of our Stockings has messages waiting to be read, or has closed.
+
+        Inputs: timeout     - The maximum number of seconds to wait, or None to wait indefinitely.
+                maxMessages - If given, the maximum number of messages to read from any one Stocking per call.  Any
+                              further messages are returned by subsequent calls.
+
+        Outputs: A list of (stocking, messages) tuples; one for each Stocking which had messages waiting to be read, or
+                 which has closed, where messages is the list of messages read from it.  Stockings which have closed
+                 are unregistered once every message they received has been read.
+        """
+
+        ready = []
+        for stocking in self._ready(timeout):
+            messages = []
+            while maxMessages is None or len(messages) < maxMessages:
+                message = stocking.read() if stocking.handshakeComplete else None
+                if message is None:
+                    break
+                messages.append(message)
+
+            if not stocking.active and (maxMessages is None or len(messages) < maxMessages):
+                self.unregister(stocking)
+
+            ready.append((stocking, messages))
+
+        return ready
+
+
+    def close(self):
+        """ Stops waiting on every Stocking, and releases the descriptor used to wait on them. """
+
+        self._stockings.clear()
+        self._handshaking.clear()
+        if self._selector is not None:
+            # Selectors hold reference cycles, so must be closed explicitly for their descriptors to be released promptly
+            self._selector.close()
+            self._selector = None
+
+
+    # Internal functions
+    def _watch(self, stocking):
+        """ Begins waiting on the fileno of the given Stocking. """
+
+        if selectors is not None:
+            if self._selector is None:
+                self._selector = selectors.DefaultSelector()
+            self._selector.register(stocking.fileno(), selectors.EVENT_READ, stocking)
+
+
+    def _ready(self, timeout):
+        """
+        Returns a list of our Stockings whose filenos are readable, waiting up to timeout seconds (or indefinitely if
+        None) for one.  While any of our Stockings are handshaking, we wake periodically to check whether they have
+        completed their handshakes (or closed), and begin waiting on those which have.
+        """
+
+        deadline = None if timeout is None else time.time() + timeout
+
+        while True:
+            for fileno, stocking in list(self._handshaking.items()):
+                if stocking.handshakeComplete or not stocking.active:
+                    del self._handshaking[fileno]
+                    self._watch(stocking)
+
+            wait = None if deadline is None else max(0, deadline - time.time())
+            if self._handshaking and (wait is None or wait > HANDSHAKE_INTERVAL):
+                wait = HANDSHAKE_INTERVAL
+
+            ready = self._wait(wait)
+            if ready or (deadline is not None and time.time() >= deadline):
+                return ready
+
+
+    def _wait(self, timeout):
+        """ Returns a list of our watched Stockings whose filenos are readable, waiting up to timeout seconds for one. """
+
+        filenos = [fileno for fileno in self._stockings if fileno not in self._handshaking]
+
+        # Neither our selector nor select.select (on all platforms) can wait on an empty set of descriptors
+        if not filenos:
+            if timeout is None:
+                threading.Event().wait()
+            elif timeout:
+                time.sleep(timeout)
+            return []
+
+        if self._selector is not None:
+            return [key.data for key, _ in self._selector.select(timeout)]
+
+        return [self._stockings[fileno] for fileno in select.select(filenos, [], [], timeout)[0]]
@@ -18,6 +18,16 @@
     Email:  warrenspencer27@gmail.com
 """
 
+# Standard imports
+import struct
+
+# Single byte bytes objects, indexed by their value
+_BYTES = [bytes(bytearray([i])) for i in range(256)]
+
+# Fixed width header; a single big endian integer holding the message's type in its top 8 bits, its flags in the
+# following 16 bits and its length in the remaining 40 bits
+_FIXED = struct.Struct('!Q')
+
 class MessageHeaders(object):
     """
     Class implementing serialization / deserialization of message headers.
@@ -31,12 +41,27 @@ class MessageHeaders(object):
           additional bytes.
           Also, the 2nd bit of the first byte of the headers is reserved for the type flag. specifying whether the
           message sent was a bytes object or a unicode object.
+          Once extended framing has been negotiated by two Stockings, the size header is followed by a single byte of
+          flags (see the FLAG_ constants below).
+          Alternatively two Stockings may negotiate fixed width headers (see serializeFixed), which cost a few more
+          bytes for small messages but are parsed in a single step rather than byte by byte.
     """
 
     # Constants
     BYTES = 0
     UNICODE = 1
 
+    # Flags sent following the message size header when using extended framing
+    FLAG_CONTROL = 1    # The message is a control message, to be consumed by the Stocking rather than delivered
+    FLAG_MORE = 2       # The message is a slice of a larger message, further slices of which follow in the same lane
+    FLAG_LANE_SHIFT = 2 # The priority lane the message was sent in is stored in the 3rd and 4th bits of the flags
+    FLAG_LANE_MASK = 12
+    FLAG_COMPRESSED = 16 # The message was compressed using the sender's compression stream
+
+    # Fixed width headers
+    FIXED_SIZE = _FIXED.size      # Number of bytes in a fixed width header
+    FIXED_MAX_LENGTH = 2**40 - 1  # Largest message length which can be sent with a fixed width header
+
     # Deserialization state variables.
     # Because deserialization can occur in increments we record the state of the current deserialization as
     # class attributes
@@ -69,6 +94,18 @@ class MessageHeaders(object):
         self._type = None
 
 
+    def getState(self):
+        """ Returns a tuple describing the progress of the deserialization in progress, which can be restored later. """
+
+        return (self._msgLength, self._completed, self._shift, self._type)
+
+
+    def setState(self, state):
+        """ Restores the progress of a deserialization, as returned by getState. """
+
+        self._msgLength, self._completed, self._shift, self._type = state
+
+
     @staticmethod
     def serialize(typ, length):
         """
@@ -102,6 +139,87 @@ class MessageHeaders(object):
         return toReturn
 
 
+    @staticmethod
+    def serializeFlags(flags):
+        """
+        Serializes the flags of a message to send when using extended framing.
+
+        Inputs: flags - An integer; a bitwise or of FLAG_ constants.
+
+        Outputs: A bytes object containing the serialized flags.
+        """
+
+        return _BYTES[flags]
+
+
+    @classmethod
+    def serializeFixed(cls, typ, length, flags):
+        """
+        Serializes the type, length and flags of a message to send as a fixed width header.  Flags are given 16 bits,
+        leaving room for flags beyond the FLAG_ constants.
+
+        Inputs: typ    - The type of message, should be one of (str/unicode) or (bytes/str)
+                length - An integer describing how long the message to serialize is; at most FIXED_MAX_LENGTH.
+                flags  - An integer; a bitwise or of FLAG_ constants.
+
+        Outputs: A bytes object FIXED_SIZE bytes long.
+        """
+
+        if length > cls.FIXED_MAX_LENGTH:
+            raise ValueError("Message of %d bytes is too long for a fixed width header" % length)
+
+        return _FIXED.pack((cls.BYTES if typ == bytes else cls.UNICODE) << 56 | flags << 40 | length)
+
+
+    @classmethod
+    def deserializeFixed(cls, buf, offset):
+        """
+        Deserializes a fixed width header.
+
+        Inputs: buf    - A buffer containing at least FIXED_SIZE bytes of the header from offset onwards.
+                offset - The index in buf of the start of the header.
+
+        Outputs: A tuple containing the type of the message (BYTES or UNICODE), its flags and its length.
+        """
+
+        header = _FIXED.unpack_from(buf, offset)[0]
+        return header >> 56, header >> 40 & 0xFFFF, header & cls.FIXED_MAX_LENGTH
+
+
+    def consume(self, buf, start, end):
+        """
+        Deserializes as much of the length and type of a message as is available from a section of a buffer.
+
+        Inputs: buf   - A bytearray (or other buffer yielding integers when indexed) containing the header.
+                start - The index in buf of the next byte of the header.
+                end   - The index in buf of the end of the available data.
+
+        Outputs: The number of bytes of buf which were consumed.  Once the entire message size header has been
+                 deserialized, no further bytes are consumed and getLength will return the message's length.
+        """
+
+        index = start
+        while index < end and not self._completed:
+            char = buf[index]
+            index += 1
+
+            # If this is the first byte we've received, process it specially, as it will contain the type flag
+            if self._shift == 1:
+                self._msgLength += char & 63
+                self._type = (self.BYTES if char & 64 else self.UNICODE)
+                self._shift <<= 6
+
+            else:
+                self._msgLength += self._shift * (char & 127)
+                self._shift <<= 7
+
+            # If the first bit on this char is set, stop processing further bytes
+            if char & 128:
+                self._completed = True
+
+        return index - start
+
+
     def deserialize(self, st):
         """
         Deserializes the length and type of a message from a string into an integer,
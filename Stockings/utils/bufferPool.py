@@ -0,0 +1,114 @@
+"""
+    This file is part of Stockings.
+
+    Stockings is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Stockings is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Stockings.  If not, see <http://www.gnu.org/licenses/>.
+
+
+    Author: Warren Spencer
+    Email:  warrenspencer27@gmail.com
+"""
+
+# Standard imports
+import threading, collections
+
+# Globals
+
+_sharedPool = None            # BufferPool shared by every Stocking, created by getBufferPool
+_sharedPoolLock = threading.Lock()
+
+
+def getBufferPool():
+    """ Returns the BufferPool shared by every Stocking in this process, creating it if necessary. """
+
+    global _sharedPool
+
+    with _sharedPoolLock:
+        if _sharedPool is None:
+            _sharedPool = BufferPool()
+        return _sharedPool
+
+
+class BufferPool(object):
+    """
+    Class implementing a pool of reusable bytearrays, to avoid allocating a new buffer for every message received.
+
+    Note: Buffers are grouped into size classes; powers of two between minSize and maxSize.  Requests for a buffer are
+          served using a buffer of the smallest class which can hold it, so a buffer may be larger than was requested.
+          Requests for buffers larger than maxSize are not pooled.  Once the pool holds maxBytes worth of buffers,
+          further released buffers are discarded rather than pooled.
+    """
+
+    minSize = None            # Size of the smallest class of buffers
+    maxSize = None            # Size of the largest class of buffers
+    maxBytes = None           # Maximum number of bytes worth of buffers to hold
+
+    _classes = None           # Dictionary mapping class sizes to deques of available buffers of that size
+    _pooledBytes = 0          # Number of bytes worth of buffers currently held
+    _lock = None              # Mutex guarding self._pooledBytes
+
+    def __init__(self, minSize=2**8, maxSize=2**24, maxBytes=2**26):
+        self.minSize = minSize
+        self.maxSize = maxSize
+        self.maxBytes = maxBytes
+        self._lock = threading.Lock()
+
+        self._classes = {}
+        size = minSize
+        while size <= maxSize:
+            self._classes[size] = collections.deque()
+            size <<= 1
+
+
+    def acquire(self, size):
+        """
+        Returns a bytearray of at least the given size; from the pool if one is available, else newly allocated.
+        The contents of the buffer are undefined.
+        """
+
+        if size > self.maxSize:
+            return bytearray(size)
+
+        classSize = max(self.minSize, 1 << (size - 1).bit_length())
+        try:
+            buf = self._classes[classSize].pop()
+
+        except IndexError:
+            return bytearray(classSize)
+
+        with self._lock:
+            self._pooledBytes -= classSize
+
+        return buf
+
+
+    def release(self, buf):
+        """ Returns a bytearray previously returned by acquire to the pool, so that it can be reused. """
+
+        size = len(buf)
+        queue = self._classes.get(size)
+        if queue is None:
+            return
+
+        with self._lock:
+            if self._pooledBytes + size > self.maxBytes:
+                return
+            self._pooledBytes += size
+
+        queue.append(buf)
+
+
+    def pooledBytes(self):
+        """ Returns the number of bytes worth of buffers currently held by the pool. """
+
+        return self._pooledBytes
@@ -0,0 +1,148 @@
+"""
+    This file is part of Stockings.
+
+    Stockings is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Stockings is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Stockings.  If not, see <http://www.gnu.org/licenses/>.
+
+
+    Author: Warren Spencer
+    Email:  warrenspencer27@gmail.com
+"""
+
+# Standard imports
+import struct, threading, time, collections
+
+# Globals
+
+# Directions a captured message can have travelled in, relative to the Stocking which captured it
+CAPTURE_SENT = 0
+CAPTURE_RECEIVED = 1
+
+# Magic bytes identifying a capture log
+_MAGIC = b'STKCAP1\n'
+
+# Each record in a capture log; its timestamp, stream, direction, type, size and the length of its payload (0 if the
+# payload was not captured), followed by the payload itself
+_RECORD = struct.Struct('<dIBBQI')
+
+CaptureRecord = collections.namedtuple('CaptureRecord', 'timestamp stream direction type size payload')
+
+
+class CaptureWriter(object):
+    """
+    Class implementing a compact binary log which Stockings record the messages they send and receive to.
+
+    Note: A single CaptureWriter can be shared between any number of Stockings; each is assigned its own stream, so
+          that the traffic of each connection can be told apart when the log is replayed.
+    """
+
+    payloads = False          # Whether or not the contents of messages are captured, rather than only their sizes
+
+    _file = None              # File object the log is written to
+    _ownsFile = False         # Whether or not we opened self._file, and so must close it
+    _streams = 0              # Number of streams which have been assigned
+    _lock = None              # Mutex serializing writes to self._file
+
+    def __init__(self, target, payloads=False):
+        """
+        Inputs: target   - The path of the file to write the log to, or a file object opened for writing in binary mode.
+                payloads - If True, the contents of each message are captured along with its size.
+        """
+
+        self.payloads = payloads
+        self._lock = threading.Lock()
+
+        if hasattr(target, 'write'):
+            self._file = target
+        else:
+            self._file = open(target, 'wb')
+            self._ownsFile = True
+
+        self._file.write(_MAGIC)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, typ, value, tb):
+        self.close()
+
+
+    def stream(self):
+        """ Returns a new stream number, identifying the messages of a single connection in the log. """
+
+        with self._lock:
+            self._streams += 1
+            return self._streams
+
+
+    def record(self, stream, direction, typ, payload):
+        """
+        Records a message sent or received by a Stocking.
+
+        Inputs: stream    - The stream number of the Stocking, as returned by self.stream.
+                direction - CAPTURE_SENT or CAPTURE_RECEIVED.
+                typ       - The type of the message; MessageHeaders.BYTES or MessageHeaders.UNICODE.
+                payload   - The message as sent over the wire, as bytes or a memoryview.
+        """
+
+        captured = payload if self.payloads else b''
+        header = _RECORD.pack(time.time(), stream, direction, typ, len(payload), len(captured))
+
+        with self._lock:
+            if self._file is not None:
+                self._file.write(header)
+                if len(captured):
+                    self._file.write(captured)
+
+
+    def close(self):
+        """ Flushes the log, closing its file if it was opened by us.  Further messages are not recorded. """
+
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+                if self._ownsFile:
+                    self._file.close()
+                self._file = None
+
+
+def readCapture(source):
+    """
+    Reads the records from a capture log.
+
+    Inputs: source - The path of the log, or a file object opened for reading in binary mode.
+
+    Outputs: A generator yielding a CaptureRecord for each message in the log, in the order they were recorded.  The
+             payload of each is bytes, or None if it was not captured.
+    """
+
+    logFile = source if hasattr(source, 'read') else open(source, 'rb')
+
+    try:
+        if logFile.read(len(_MAGIC)) != _MAGIC:
+            raise ValueError("Not a Stockings capture log")
+
+        while True:
+            header = logFile.read(_RECORD.size)
+            if len(header) < _RECORD.size:
+                return
+
+            timestamp, stream, direction, typ, size, payloadSize = _RECORD.unpack(header)
+            payload = logFile.read(payloadSize) if payloadSize else None
+            yield CaptureRecord(timestamp, stream, direction, typ, size, payload)
+
+    finally:
+        if logFile is not source:
+            logFile.close()
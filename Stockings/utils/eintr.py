@@ -51,3 +51,23 @@ def recv(sock, bytes):
             if errno.errorcode[e.errno] in MASKED_ERRORS:
                 return
             raise
+
+
+def recvInto(sock, buf, bytes):
+    """
+    Receives data from the given socket into a buffer, masking socket-closed, and EAGAIN errors (returning None in
+    this case).  Also repeatedly runs the command if it is interrupted by another system call.
+
+    Returns: The number of bytes read if successful, else None if we were unable to read from the socket.
+    """
+
+    while True:
+        try:
+            return sock.recv_into(buf, bytes)
+
+        except (IOError, socket.error) as e:
+            if e.errno == errno.EINTR:
+                continue
+            if errno.errorcode[e.errno] in MASKED_ERRORS:
+                return
+            raise
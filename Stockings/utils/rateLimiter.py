@@ -0,0 +1,201 @@
+"""
+    This file is part of Stockings.
+
+    Stockings is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Stockings is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Stockings.  If not, see <http://www.gnu.org/licenses/>.
+
+
+    Author: Warren Spencer
+    Email:  warrenspencer27@gmail.com
+"""
+
+# Standard imports
+import threading, time
+
+# Globals
+
+# Directions which traffic can be limited in
+SEND = 'send'
+RECV = 'recv'
+
+# Default value of RateLimiter.setLimits's arguments, distinguishing limits which are left unchanged from those which
+# are removed by passing None
+_UNCHANGED = object()
+
+
+class TokenBucket(object):
+    """
+    Class implementing a token bucket; tokens accumulate at a fixed rate up to a maximum, and are consumed by traffic.
+
+    Note: Traffic is allowed whenever the bucket holds at least one token, and may then consume more tokens than the
+          bucket holds, leaving it in debt.  This allows traffic of any size to be limited without needing to know its
+          size in advance, while still enforcing the rate on average.
+    """
+
+    rate = None               # Number of tokens added to the bucket per second
+    capacity = None           # Maximum number of tokens the bucket can hold
+
+    _tokens = 0               # Number of tokens currently in the bucket; negative if it is in debt
+    _updated = None           # Time at which self._tokens was last brought up to date
+    _lock = None              # Mutex guarding self._tokens, as buckets may be shared between threads
+
+    def __init__(self, rate, burst=1.0):
+        """
+        Inputs: rate  - The number of tokens added to the bucket per second.
+                burst - The number of seconds worth of tokens the bucket can hold.
+        """
+
+        self._lock = threading.Lock()
+        self.setRate(rate, burst)
+        self._tokens = self.capacity
+        self._updated = time.time()
+
+
+    def setRate(self, rate, burst=1.0):
+        """ Changes the rate tokens are added to the bucket, and the number of seconds worth of tokens it can hold. """
+
+        if rate <= 0:
+            raise ValueError("Rate must be positive: %r" % (rate,))
+
+        with self._lock:
+            self.rate = float(rate)
+            self.capacity = max(1.0, rate * burst)
+            self._tokens = min(self._tokens, self.capacity)
+
+
+    def delay(self, now):
+        """ Returns the number of seconds until the bucket will hold at least one token, or 0 if it does now. """
+
+        with self._lock:
+            self._refill(now)
+            if self._tokens >= 1:
+                return 0
+            return (1 - self._tokens) / self.rate
+
+
+    def consume(self, amount, now):
+        """ Removes the given number of tokens from the bucket, leaving it in debt if it does not hold enough. """
+
+        with self._lock:
+            self._refill(now)
+            self._tokens -= amount
+
+
+    def state(self):
+        """ Returns a dictionary describing the bucket's rate, capacity and the number of tokens it holds. """
+
+        with self._lock:
+            self._refill(time.time())
+            return {'rate': self.rate, 'capacity': self.capacity, 'tokens': self._tokens}
+
+
+    def _refill(self, now):
+        """ Adds the tokens accumulated since the bucket was last updated.  Must be called holding self._lock. """
+
+        if now > self._updated:
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+
+
+class RateLimiter(object):
+    """
+    Class implementing limits on the rate of traffic sent and received; in bytes and messages per second.
+
+    Note: A RateLimiter can be given to a single Stocking as its rateLimiter, or shared by a group of Stockings as
+          their rateGroup, in which case the limits apply to their traffic in aggregate.  Limits can be changed at any
+          time.
+    """
+
+    burst = 1.0               # Number of seconds worth of traffic which may be sent or received in a single burst
+
+    _buckets = None           # Dictionary mapping the names of the limits which are enforced to their TokenBucket
+
+    def __init__(self, sendBytes=None, sendMessages=None, recvBytes=None, recvMessages=None, burst=1.0):
+        """
+        Inputs: sendBytes    - If given, the maximum number of bytes per second which may be sent.
+                sendMessages - If given, the maximum number of messages per second which may be sent.
+                recvBytes    - If given, the maximum number of bytes per second which may be received.
+                recvMessages - If given, the maximum number of messages per second which may be received.
+                burst        - The number of seconds worth of traffic which may be sent or received in a single burst.
+        """
+
+        self.burst = burst
+        self._buckets = {}
+        self.setLimits(sendBytes, sendMessages, recvBytes, recvMessages)
+
+
+    def setLimits(self, sendBytes=_UNCHANGED, sendMessages=_UNCHANGED, recvBytes=_UNCHANGED, recvMessages=_UNCHANGED):
+        """
+        Changes the limits enforced.  Limits which are not given are left unchanged, and limits given as None are
+        removed.
+        """
+
+        limits = {'sendBytes': sendBytes, 'sendMessages': sendMessages, 'recvBytes': recvBytes,
+                  'recvMessages': recvMessages}
+
+        # Buckets are replaced rather than modified in place, so that readers never need to lock self._buckets
+        buckets = dict(self._buckets)
+        for name, rate in limits.items():
+            if rate is _UNCHANGED:
+                continue
+            elif rate is None:
+                buckets.pop(name, None)
+            elif name in buckets:
+                buckets[name].setRate(rate, self.burst)
+            else:
+                buckets[name] = TokenBucket(rate, self.burst)
+
+        self._buckets = buckets
+
+
+    def delay(self, direction, now=None):
+        """
+        Returns the number of seconds until traffic may next flow in the given direction (SEND or RECV), or 0 if it may
+        flow now.
+        """
+
+        buckets = self._buckets
+        if not buckets:
+            return 0
+
+        now = time.time() if now is None else now
+        delay = 0
+        for name in (direction + 'Bytes', direction + 'Messages'):
+            bucket = buckets.get(name)
+            if bucket is not None:
+                delay = max(delay, bucket.delay(now))
+
+        return delay
+
+
+    def consume(self, direction, size=0, messages=0, now=None):
+        """ Records size bytes and a number of messages as having flowed in the given direction (SEND or RECV). """
+
+        buckets = self._buckets
+        if not buckets:
+            return
+
+        now = time.time() if now is None else now
+        for name, amount in ((direction + 'Bytes', size), (direction + 'Messages', messages)):
+            bucket = buckets.get(name)
+            if bucket is not None and amount:
+                bucket.consume(amount, now)
+
+
+    def state(self):
+        """
+        Returns a dictionary mapping the names of the limits which are enforced to dictionaries describing their
+        current state; their rate, capacity and the number of tokens available (negative if they are in debt).
+        """
+
+        return dict((name, bucket.state()) for name, bucket in self._buckets.items())
@@ -0,0 +1,238 @@
+"""
+    This file is part of Stockings.
+
+    Stockings is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Stockings is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Stockings.  If not, see <http://www.gnu.org/licenses/>.
+
+
+    Author: Warren Spencer
+    Email:  warrenspencer27@gmail.com
+"""
+
+import threading, time, math, traceback
+
+# Globals
+
+SLOT_BITS = 6                 # Each level of the wheel has 2**SLOT_BITS slots
+SLOTS = 1 << SLOT_BITS
+SLOT_MASK = SLOTS - 1
+
+_sharedWheel = None           # TimerWheel shared by every Stocking, created by getTimerWheel
+_sharedWheelLock = threading.Lock()
+
+
+def getTimerWheel():
+    """ Returns the TimerWheel shared by every Stocking in this process, creating it if necessary. """
+
+    global _sharedWheel
+
+    with _sharedWheelLock:
+        if _sharedWheel is None:
+            _sharedWheel = TimerWheel()
+        return _sharedWheel
+
+
+class Timer(object):
+    """ A callback scheduled on a TimerWheel. """
+
+    __slots__ = ('expiry', 'callback', 'bucket')
+
+    def __init__(self, callback):
+        self.expiry = None      # Tick at which this timer expires
+        self.callback = callback
+        self.bucket = None      # Slot of the wheel this timer is currently in, or None if it has fired or been cancelled
+
+
+class TimerWheel(object):
+    """
+    Class implementing a hierarchical timer wheel, allowing a single thread to cheaply manage the timers of any
+    number of connections.
+
+    Note: Time is divided into ticks of `resolution` seconds.  The first level of the wheel has a slot for each of the
+          next SLOTS ticks; each subsequent level has SLOTS slots each spanning an entire rotation of the level below
+          it.  As the wheel turns, the timers in a slot of a higher level are cascaded down into the levels below.
+          Scheduling and cancelling a timer are O(1), and the wheel's thread only wakes when a timer in the first
+          level is due, or when the first level completes a rotation while timers are waiting in higher levels.
+          Timers are fired no earlier than they are due, and no later than `resolution` seconds after.
+    """
+
+    resolution = None         # Number of seconds per tick
+
+    _levels = None            # List of levels, each a list of SLOTS sets of Timers
+    _epoch = None             # Time at which tick 0 occurred
+    _tick = 0                 # The last tick which has been processed
+    _count = 0                # Number of timers currently scheduled
+    _wakeTick = None          # Tick our thread is sleeping until, or None if it is sleeping indefinitely
+    _condition = None         # Condition guarding our state, which our thread waits upon
+    _thread = None            # Thread firing our timers, started upon the first call to schedule
+
+    def __init__(self, resolution=.1, levels=4):
+        self.resolution = resolution
+        self._levels = [[set() for _ in range(SLOTS)] for _ in range(levels)]
+        self._epoch = time.time()
+        self._condition = threading.Condition(threading.Lock())
+
+
+    # API functions
+    def schedule(self, delay, callback):
+        """
+        Schedules a callback to be called from our thread after a delay.  The callback should return quickly, as it
+        delays the firing of every other timer until it does.
+
+        Inputs: delay    - The number of seconds to wait before calling callback.
+                callback - A function accepting no arguments.
+
+        Outputs: A Timer which can be passed to cancel.
+        """
+
+        timer = Timer(callback)
+
+        with self._condition:
+            timer.expiry = max(self._tick + 1, int(math.ceil((time.time() + delay - self._epoch) / self.resolution)))
+            self._insert(timer)
+            self._count += 1
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+
+            # Wake our thread if it would otherwise sleep through this timer
+            elif self._wakeTick is None or timer.expiry < self._wakeTick:
+                self._condition.notify()
+
+        return timer
+
+
+    def cancel(self, timer):
+        """ Cancels a scheduled timer.  Does nothing if the timer has already fired or been cancelled. """
+
+        with self._condition:
+            if timer.bucket is not None:
+                timer.bucket.discard(timer)
+                timer.bucket = None
+                self._count -= 1
+
+
+    def __len__(self):
+        return self._count
+
+
+    # Internal functions
+    def _insert(self, timer):
+        """ Places a timer into the slot of the wheel appropriate for its expiry.  Should be called locked. """
+
+        # Timers go into the lowest level whose current slot's span contains their expiry, or failing that the top
+        # level if their expiry is within one of its rotations.  Timers too far in the future for the wheel are placed
+        # in the slot of the top level which will be cascaded last, and are re-placed when it is.
+        for level in range(len(self._levels)):
+            shift = SLOT_BITS * level
+            if (timer.expiry >> (shift + SLOT_BITS)) == (self._tick >> (shift + SLOT_BITS)):
+                slot = (timer.expiry >> shift) & SLOT_MASK
+                break
+        else:
+            if timer.expiry - self._tick < (SLOTS << shift):
+                slot = (timer.expiry >> shift) & SLOT_MASK
+            else:
+                slot = ((self._tick >> shift) - 1) & SLOT_MASK
+
+        timer.bucket = self._levels[level][slot]
+        timer.bucket.add(timer)
+
+
+    def _nextTick(self):
+        """
+        Returns the next tick at which our thread has work to do; either a tick whose slot in the first level contains
+        timers, or the end of the first level's rotation if higher levels contain timers.  Returns None if there are
+        no timers scheduled.  Should be called locked.
+        """
+
+        if not self._count:
+            return None
+
+        firstLevel = self._levels[0]
+        boundary = (self._tick | SLOT_MASK) + 1
+        for tick in range(self._tick + 1, boundary):
+            if firstLevel[tick & SLOT_MASK]:
+                return tick
+
+        return boundary
+
+
+    def _advance(self, target):
+        """
+        Turns the wheel until self._tick reaches target, cascading timers from higher levels as their slots are
+        reached.  Should be called locked.
+
+        Outputs: A list of Timers which have expired.
+        """
+
+        expired = []
+
+        while self._tick < target:
+            tick = self._nextTick()
+            if tick is None or tick > target:
+                self._tick = target
+                break
+
+            self._tick = tick
+
+            # Cascade the timers of the higher levels whose slots we've reached, starting with the highest so that
+            # timers cascaded from it into a lower level's current slot are themselves cascaded
+            cascading = []
+            for level in range(1, len(self._levels)):
+                if tick & ((1 << (SLOT_BITS * level)) - 1):
+                    break
+                cascading.insert(0, level)
+
+            for level in cascading:
+                bucket = self._levels[level][(tick >> (SLOT_BITS * level)) & SLOT_MASK]
+                timers = list(bucket)
+                bucket.clear()
+                for timer in timers:
+                    self._insert(timer)
+
+            bucket = self._levels[0][tick & SLOT_MASK]
+            for timer in bucket:
+                timer.bucket = None
+            expired.extend(bucket)
+            self._count -= len(bucket)
+            bucket.clear()
+
+        return expired
+
+
+    def _run(self):
+        """ Body of our thread; fires timers as they expire. """
+
+        while True:
+            with self._condition:
+                while True:
+                    expired = self._advance(int((time.time() - self._epoch) / self.resolution))
+                    if expired:
+                        self._wakeTick = self._tick
+                        break
+
+                    self._wakeTick = self._nextTick()
+                    if self._wakeTick is None:
+                        self._condition.wait()
+                    else:
+                        self._condition.wait(max(0, self._epoch + self._wakeTick * self.resolution - time.time()))
+
+            for timer in expired:
+                try:
+                    timer.callback()
+
+                # A failing callback should not prevent the timers of other connections from firing
+                except Exception:
+                    traceback.print_exc()
@@ -0,0 +1,347 @@
+"""
+    This file is part of Stockings.
+
+    Stockings is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Stockings is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Stockings.  If not, see <http://www.gnu.org/licenses/>.
+
+
+    Author: Warren Spencer
+    Email:  warrenspencer27@gmail.com
+"""
+
+# Standard imports
+import ssl, socket, errno, threading, time, collections
+
+# Globals
+
+# Number of bytes of encrypted data received from our socket at once
+RECV_SIZE = 65536
+
+# Maximum number of bytes of encrypted data which may be waiting to be sent before we stop encrypting more
+MAX_PENDING = 262144
+
+_sharedCache = None           # SessionCache shared by every Stocking, created by getSessionCache
+_sharedCacheLock = threading.Lock()
+
+
+def getSessionCache():
+    """ Returns the SessionCache shared by every Stocking which is not given one of its own, creating it if needed. """
+
+    global _sharedCache
+
+    with _sharedCacheLock:
+        if _sharedCache is None:
+            _sharedCache = SessionCache()
+        return _sharedCache
+
+
+class SessionCache(object):
+    """
+    Class implementing a cache of the TLS sessions established by client Stockings, so that reconnecting to the same
+    server resumes a session rather than performing a full handshake.
+
+    Note: Sessions are keyed by the hostname of the server if one was given, otherwise by its address.  The least
+          recently used session is evicted once the cache is full, and sessions which have expired are never returned.
+    """
+
+    maxSessions = 1024        # Maximum number of sessions held
+
+    _sessions = None          # OrderedDict mapping keys to sessions, least recently used first
+    _lock = None              # Mutex guarding self._sessions, as caches are shared between threads
+
+    def __init__(self, maxSessions=1024):
+        self.maxSessions = maxSessions
+        self._sessions = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+
+    # Data Model functions
+    def __len__(self):
+        return len(self._sessions)
+
+
+    # API functions
+    def get(self, key):
+        """ Returns the session cached for the given key, or None if there is none which has yet to expire. """
+
+        with self._lock:
+            session = self._sessions.pop(key, None)
+            if session is None or session.time + session.timeout < time.time():
+                return None
+
+            self._sessions[key] = session
+            return session
+
+
+    def put(self, key, session):
+        """ Caches a session under the given key, replacing any already cached for it. """
+
+        with self._lock:
+            self._sessions.pop(key, None)
+            self._sessions[key] = session
+            while len(self._sessions) > self.maxSessions:
+                self._sessions.popitem(last=False)
+
+
+    def discard(self, key):
+        """ Removes any session cached for the given key. """
+
+        with self._lock:
+            self._sessions.pop(key, None)
+
+
+class TLSConnection(object):
+    """
+    Class implementing a TLS session over a non-blocking socket, using memory BIOs so that it can be driven by a
+    Stocking's own I/O loop.  Encrypted data is received from the socket by receive, and decrypted data read using
+    recvInto; data to send is encrypted by send, which also sends as much of the encrypted data as the socket accepts.
+    Any encrypted data which could not be sent is held until flush is next called.
+    """
+
+    sock = None               # The non-blocking socket the session is carried over
+    serverSide = False        # Whether we're the server or the client of the session
+    established = False       # Whether or not the session's handshake has completed
+    closed = False            # Set once the remote has closed the session
+    error = None              # The ssl.SSLError which ended the session, if any
+
+    _tls = None               # ssl.SSLObject implementing the session
+    _incoming = None          # ssl.MemoryBIO of encrypted data received from the socket, waiting to be decrypted
+    _outgoing = None          # ssl.MemoryBIO of encrypted data waiting to be sent
+    _unsent = b""             # Encrypted data read from self._outgoing which the socket did not accept
+    _cache = None             # SessionCache our session is stored in once established, if we're the client
+    _cacheKey = None          # Key of our session in self._cache
+    _sessionStored = False    # Whether or not our session has been stored in self._cache
+
+    def __init__(self, sock, context, serverSide=False, hostname=None, sessionCache=None, cacheKey=None):
+        """
+        Inputs: sock         - The non-blocking socket to carry the session over.
+                context      - The ssl.SSLContext to create the session with.
+                serverSide   - Whether we're the server or the client of the session.
+                hostname     - The hostname of the server, if we're the client; used to verify its certificate.
+                sessionCache - The SessionCache to resume sessions from and store sessions in, if we're the client.
+                cacheKey     - The key of our session in sessionCache; by default the hostname.
+        """
+
+        self.sock = sock
+        self.serverSide = serverSide
+        self._incoming = ssl.MemoryBIO()
+        self._outgoing = ssl.MemoryBIO()
+
+        session = None
+        if not serverSide and sessionCache is not None:
+            self._cache = sessionCache
+            self._cacheKey = hostname if cacheKey is None else cacheKey
+            session = sessionCache.get(self._cacheKey)
+
+        try:
+            self._tls = context.wrap_bio(self._incoming, self._outgoing, serverSide, hostname, session)
+
+        # Sessions can only be resumed using the context they were created with
+        except ValueError:
+            if session is None:
+                raise
+            self._tls = context.wrap_bio(self._incoming, self._outgoing, serverSide, hostname)
+
+
+    # API functions
+    def start(self):
+        """ Begins the session's handshake, producing our first handshake message if we're the client. """
+
+        self._handshake()
+
+
+    def receive(self):
+        """
+        Receives encrypted data from the socket, advancing the session's handshake if it has yet to complete, and
+        sending any encrypted data which that produces.
+
+        Outputs: False if the remote has closed the connection or the session has failed, otherwise True.
+        """
+
+        try:
+            data = self.sock.recv(RECV_SIZE)
+
+        except socket.error as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return True
+            raise
+
+        if not data:
+            self.closed = True
+            return False
+
+        self._incoming.write(data)
+        if not self.established and not self._handshake():
+            return False
+
+        self._storeSession()
+        self._flushQuietly()
+        return not self.closed
+
+
+    def recvInto(self, buf, nbytes):
+        """
+        Reads data decrypted by the session into a buffer.
+
+        Outputs: The number of bytes read, 0 if the remote has closed the session, or None if no decrypted data is
+                 available.
+        """
+
+        if not self.established:
+            return None
+
+        try:
+            read = self._tls.read(nbytes, buf)
+
+        # Once everything received has been decrypted, any session ticket the server sent has been processed too
+        except ssl.SSLWantReadError:
+            self._storeSession()
+            return None
+
+        except ssl.SSLZeroReturnError:
+            self.closed = True
+            return 0
+
+        except ssl.SSLError as e:
+            self.error, self.closed = e, True
+            return 0
+
+        return read
+
+
+    def send(self, segments):
+        """
+        Encrypts as much of a sequence of segments as we can buffer, and sends as much of the encrypted data as the
+        socket accepts.  Nothing is encrypted until the session is established.
+
+        Outputs: The number of bytes of the segments which were encrypted, and so need not be passed again.
+        """
+
+        self.flush()
+
+        encrypted = 0
+        if self.established:
+            for segment in segments:
+                room = MAX_PENDING - self._outgoing.pending - len(self._unsent)
+                if room <= 0:
+                    break
+
+                if len(segment) > room:
+                    segment = memoryview(segment)[:room]
+                written = self._tls.write(segment)
+                encrypted += written
+                if written < len(segment):
+                    break
+
+        self.flush()
+        return encrypted
+
+
+    def flush(self):
+        """
+        Sends as much of the encrypted data waiting to be sent as the socket accepts.
+
+        Outputs: A boolean indicating whether or not all of it was sent.
+        """
+
+        while True:
+            if not self._unsent:
+                if not self._outgoing.pending:
+                    return True
+                self._unsent = self._outgoing.read()
+
+            try:
+                sent = self.sock.send(self._unsent)
+
+            except socket.error as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                    return False
+                raise
+
+            self._unsent = self._unsent[sent:]
+
+
+    def pending(self):
+        """ Returns a boolean indicating whether or not there is encrypted data waiting to be sent. """
+
+        return bool(self._unsent) or self._outgoing.pending > 0
+
+
+    def close(self):
+        """ Stores our session for resumption, if we're the client and it can be resumed. """
+
+        self._storeSession()
+
+
+    def state(self):
+        """
+        Returns a dictionary describing the session; whether it's established, the TLS version and cipher in use,
+        whether it resumed an earlier session, and the error which ended it, if any.
+        """
+
+        established = self.established
+        return {
+            'established': established,
+            'version': self._tls.version() if established else None,
+            'cipher': self._tls.cipher()[0] if established else None,
+            'resumed': self._tls.session_reused if established else False,
+            'error': self.error
+        }
+
+
+    # Internal functions
+    def _handshake(self):
+        """
+        Advances the session's handshake.
+
+        Outputs: False if the handshake has failed, otherwise True.
+        """
+
+        try:
+            self._tls.do_handshake()
+            self.established = True
+
+        except (ssl.SSLWantReadError, ssl.SSLWantWriteError):
+            pass
+
+        except ssl.SSLError as e:
+            self.error, self.closed = e, True
+            # Let the remote know why the handshake failed, if we can
+            self._flushQuietly()
+            return False
+
+        self._flushQuietly()
+        return True
+
+
+    def _flushQuietly(self):
+        """ Sends what encrypted data we can, ignoring any errors; those which persist are raised by later calls. """
+
+        try:
+            self.flush()
+
+        except socket.error:
+            pass
+
+
+    def _storeSession(self):
+        """ Stores our session in self._cache once it can be resumed, if we're the client. """
+
+        if self._cache is None or self._sessionStored or not self.established:
+            return
+
+        # TLS 1.3 sessions can only be resumed once the server has sent its session ticket, after the handshake
+        session = self._tls.session
+        if session is not None and (session.has_ticket or self._tls.version() != 'TLSv1.3'):
+            self._cache.put(self._cacheKey, session)
+            self._sessionStored = True
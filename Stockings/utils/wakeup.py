@@ -0,0 +1,116 @@
+"""
+    This file is part of Stockings.
+
+    Stockings is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Stockings is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Stockings.  If not, see <http://www.gnu.org/licenses/>.
+
+
+    Author: Warren Spencer
+    Email:  warrenspencer27@gmail.com
+"""
+
+import socket
+
+from . import eintr
+
+def socketpair():
+    """
+    Returns a pair of connected sockets.  Uses socket.socketpair where it is available, otherwise (Python 2 on Windows)
+    connects a pair of sockets over the loopback interface.
+    """
+
+    if hasattr(socket, 'socketpair'):
+        return socket.socketpair()
+
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        first = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        first.connect(listener.getsockname())
+        second = listener.accept()[0]
+        return first, second
+
+    finally:
+        listener.close()
+
+
+class Wakeup(object):
+    """
+    Class implementing a file descriptor which one thread can poll on, to be woken when another thread sets it.
+
+    The descriptor is level triggered; it remains readable from the time it is set until the time it is cleared.  Once
+    set, setting it again costs no system calls until it has been cleared, so a producer can set it after queueing
+    every item without paying for a system call each time.
+
+    Note: The consumer should clear the Wakeup only once it has found its queue to be empty, and then check the queue
+          once more, as an item may have been queued after it was found to be empty but before it was cleared.
+    """
+
+    _reader = None  # Socket which is polled on, becoming readable when we're set
+    _writer = None  # Socket which is written to in order to set us
+    _fileno = None  # File descriptor of self._reader
+    _set = False    # Boolean indicating whether or not a byte may be waiting to be read from self._reader
+
+    def __init__(self):
+        self._reader, self._writer = socketpair()
+        self._reader.setblocking(0)
+        self._writer.setblocking(0)
+        self._fileno = self._reader.fileno()
+
+
+    def fileno(self):
+        """ Returns the file descriptor which can be polled on. """
+
+        return self._fileno
+
+
+    def set(self):
+        """ Makes our file descriptor readable. """
+
+        if not self._set:
+            self._set = True
+            try:
+                self._writer.send(b'\0')
+
+            # Our buffer may be full, in which case we are already readable; or we may have been closed
+            except (IOError, socket.error):
+                pass
+
+
+    def clear(self):
+        """ Makes our file descriptor unreadable, unless our writing end has been closed. """
+
+        if self._set:
+            try:
+                while eintr.recv(self._reader, 4096):
+                    pass
+
+            except (IOError, socket.error):
+                pass
+
+            self._set = False
+
+
+    def closeWriter(self):
+        """ Closes our writing end, making our file descriptor permanently readable. """
+
+        self._set = True
+        self._writer.close()
+
+
+    def close(self):
+        """ Closes both ends of our file descriptor. """
+
+        self._writer.close()
+        self._reader.close()
@@ -0,0 +1,405 @@
+"""
+    This file is part of Stockings.
+
+    Stockings is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Stockings is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Stockings.  If not, see <http://www.gnu.org/licenses/>.
+
+
+    Author: Warren Spencer
+    Email:  warrenspencer27@gmail.com
+"""
+
+# Standard imports
+import argparse, threading, select, socket, time, json, os
+
+# Project imports
+import Stockings
+from Stockings.utils import wakeup, MessageHeaders
+
+STOCKING_CLASSES = {
+    'poll': getattr(Stockings, 'PollStocking', None),
+    'select': Stockings.SelectStocking
+}
+
+
+def stockingPair(stockingClass, **kwargs):
+    """ Returns a pair of connected Stockings of the given class, once both have completed their handshakes. """
+
+    first, second = wakeup.socketpair()
+    first, second = stockingClass(first, **kwargs), stockingClass(second, **kwargs)
+    while not (first.handshakeComplete and second.handshakeComplete):
+        time.sleep(.001)
+
+    return first, second
+
+
+def report(name, count, elapsed, **extra):
+    """ Prints a single line of benchmark results. """
+
+    fields = ["%-32s" % name, "%10d msgs" % count, "%8.3fs" % elapsed, "%12.0f msgs/s" % (count / elapsed)]
+    fields.extend("%s=%s" % (key, extra[key]) for key in sorted(extra))
+    print("  ".join(fields))
+
+
+def percentile(values, fraction):
+    """ Returns the value at the given fraction (0-1) of a sorted list of values. """
+
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def cpuTime():
+    """ Returns the number of CPU seconds used by this process. """
+
+    times = os.times()
+    return times[0] + times[1]
+
+
+def drainSockets(socks, expected):
+    """ Receives and discards data from the given sockets until expected bytes have been received from them. """
+
+    poller = select.poll() if hasattr(select, 'poll') else None
+    for sock in socks:
+        sock.setblocking(0)
+        if poller is not None:
+            poller.register(sock, select.POLLIN)
+    byFileno = dict((sock.fileno(), sock) for sock in socks)
+
+    received = 0
+    while received < expected:
+        if poller is not None:
+            ready = [byFileno[fileno] for fileno, _ in poller.poll(1000)]
+        else:
+            ready = select.select(socks, [], [], 1)[0]
+
+        for sock in ready:
+            try:
+                received += len(sock.recv(262144))
+
+            except socket.error:
+                pass
+
+
+# Benchmarks
+def benchContention(args):
+    """
+    Measures read throughput as the number of consumer threads reading from a single Stocking grows, while its I/O
+    thread is concurrently queueing messages for them.
+    """
+
+    for threads in args.threads:
+        sender, receiver = stockingPair(args.stockingClass)
+        remaining = [args.messages]
+        remainingLock = threading.Lock()
+
+        def consume():
+            consumed = 0
+            while True:
+                if receiver.read() is not None:
+                    consumed += 1
+                    continue
+
+                with remainingLock:
+                    remaining[0] -= consumed
+                    consumed = 0
+                    if remaining[0] <= 0:
+                        return
+
+                # Wait for more messages to arrive, as a consumer would
+                select.select([receiver], [], [], .01)
+
+        consumers = [threading.Thread(target=consume) for _ in range(threads)]
+        start = time.time()
+        for consumer in consumers:
+            consumer.start()
+
+        for _ in range(args.messages):
+            sender.write('m')
+
+        for consumer in consumers:
+            consumer.join()
+
+        report("contention[%d consumers]" % threads, args.messages, time.time() - start)
+        sender.close()
+        receiver.close()
+
+
+def benchReceive(args):
+    """
+    Measures the throughput of receiving bytes messages of various sizes, with messages copied out of the receive
+    buffers and with borrowed buffers.
+    """
+
+    for size in args.sizes:
+        for borrow in (False, True):
+            sender, receiver = stockingPair(args.stockingClass, borrowBuffers=borrow)
+            message = b'm' * size
+
+            start = time.time()
+            for _ in range(args.messages):
+                sender.write(message)
+
+            received = 0
+            while received < args.messages:
+                read = receiver.read()
+                if read is None:
+                    select.select([receiver], [], [], .01)
+                    continue
+
+                received += 1
+                if borrow:
+                    receiver.release(read)
+
+            elapsed = time.time() - start
+            report("receive[%d bytes%s]" % (size, ", borrowed" if borrow else ""), args.messages, elapsed,
+                   MB_s="%.1f" % (size * args.messages / elapsed / 2**20))
+            sender.close()
+            receiver.close()
+
+
+def benchBroadcast(args):
+    """
+    Measures the cost of fanning a message out to many subscribers; sending its serialized frame on each of their
+    sockets directly, calling write on each of their Stockings, and using broadcast.  Each subscriber's remote is a plain
+    socket drained by a single thread, so that only the cost of sending is compared.
+    """
+
+    message = b'm' * 64
+    frame = MessageHeaders.MessageHeaders.serialize(bytes, len(message)) + message
+
+    for connections in args.connections:
+        perConnection = max(1, args.messages // connections)
+        total = perConnection * connections
+
+        for method in ('sockets', 'write', 'broadcast'):
+            pairs = [wakeup.socketpair() for _ in range(connections)]
+            remotes = [remote for _, remote in pairs]
+            if method == 'sockets':
+                subscribers = [sock for sock, _ in pairs]
+            else:
+                subscribers = [args.stockingClass(sock) for sock, _ in pairs]
+                while not all(subscriber.handshakeComplete for subscriber in subscribers):
+                    time.sleep(.001)
+
+            drainer = threading.Thread(target=drainSockets, args=(remotes, total * len(frame)))
+            start = time.time()
+            drainer.start()
+            for _ in range(perConnection):
+                if method == 'sockets':
+                    for subscriber in subscribers:
+                        subscriber.sendall(frame)
+                elif method == 'write':
+                    for subscriber in subscribers:
+                        subscriber.write(message)
+                else:
+                    Stockings.broadcast(subscribers, message)
+            drainer.join()
+
+            report("broadcast[%d conns %s]" % (connections, method), total, time.time() - start)
+            for subscriber in subscribers:
+                subscriber.close()
+            for remote in remotes:
+                remote.close()
+
+
+def benchCompression(args):
+    """
+    Measures the throughput of sending small, similar JSON messages with and without compression, along with the
+    compression ratio achieved and CPU time spent compressing.
+    """
+
+    messages = [json.dumps({'id': i, 'name': "stocking", 'values': list(range(i % 10)), 'status': "ok"})
+                for i in range(args.messages)]
+
+    for level in (None, 1, 6):
+        sender, receiver = stockingPair(args.stockingClass, compression=level, compressionThreshold=32, negotiate=True)
+
+        start = time.time()
+        for message in messages:
+            sender.write(message)
+
+        received = 0
+        while received < args.messages:
+            if receiver.read() is None:
+                select.select([receiver], [], [], .01)
+            else:
+                received += 1
+
+        stats = sender.compressionStats()['sent']
+        report("compression[level %s]" % level, args.messages, time.time() - start,
+               ratio="%.2f" % (stats['ratio'] or 1), cpu="%.3fs" % stats['cpuTime'])
+        sender.close()
+        receiver.close()
+
+
+def benchFanIn(args):
+    """
+    Measures the throughput of a single consumer thread reading from many Stockings at once using a StockingSelector.
+    """
+
+    for connections in args.connections:
+        pairs = [stockingPair(args.stockingClass) for _ in range(connections)]
+        selector = Stockings.StockingSelector()
+        for _, receiver in pairs:
+            selector.register(receiver)
+
+        perConnection = max(1, args.messages // connections)
+        total = perConnection * connections
+        start = time.time()
+        for _ in range(perConnection):
+            for sender, _ in pairs:
+                sender.write('m')
+
+        received = 0
+        while received < total:
+            for _, messages in selector.select(1):
+                received += len(messages)
+
+        report("fanin[%d connections]" % connections, total, time.time() - start)
+        selector.close()
+        for sender, receiver in pairs:
+            sender.close()
+            receiver.close()
+
+
+def benchHeaders(args):
+    """
+    Measures the cost of serializing and parsing message headers using the variable length format (with its byte of
+    flags) and the fixed width format, then the throughput of small messages sent between Stockings using each.
+    """
+
+    headers = MessageHeaders.MessageHeaders
+    for size in args.sizes:
+        variable = headers.serialize(bytes, size) + headers.serializeFlags(headers.FLAG_COMPRESSED)
+        fixed = headers.serializeFixed(bytes, size, headers.FLAG_COMPRESSED)
+
+        start = time.time()
+        for _ in range(args.messages):
+            headers.serialize(bytes, size) + headers.serializeFlags(headers.FLAG_COMPRESSED)
+        report("headers[variable encode %d]" % size, args.messages, time.time() - start, bytes=len(variable))
+
+        parser = headers()
+        buf = bytearray(variable)
+        start = time.time()
+        for _ in range(args.messages):
+            consumed = parser.consume(buf, 0, len(buf))
+            parser.getLength(), parser.getType(), buf[consumed]
+            parser.reset()
+        report("headers[variable decode %d]" % size, args.messages, time.time() - start, bytes=len(variable))
+
+        start = time.time()
+        for _ in range(args.messages):
+            headers.serializeFixed(bytes, size, headers.FLAG_COMPRESSED)
+        report("headers[fixed encode %d]" % size, args.messages, time.time() - start, bytes=len(fixed))
+
+        buf = bytearray(fixed)
+        start = time.time()
+        for _ in range(args.messages):
+            headers.deserializeFixed(buf, 0)
+        report("headers[fixed decode %d]" % size, args.messages, time.time() - start, bytes=len(fixed))
+
+    # Both ends offer a heartbeat so that extended framing is negotiated in either case, isolating the header format
+    for fixedHeaders in (False, True):
+        sender, receiver = stockingPair(args.stockingClass, fixedHeaders=fixedHeaders, heartbeatInterval=60,
+                                        negotiate=True)
+
+        start = time.time()
+        for _ in range(args.messages):
+            sender.write(b'm')
+
+        received = 0
+        while received < args.messages:
+            if receiver.read() is None:
+                select.select([receiver], [], [], .01)
+            else:
+                received += 1
+
+        report("headers[%s stream]" % ("fixed" if fixedHeaders else "variable"), args.messages, time.time() - start)
+        sender.close()
+        receiver.close()
+
+
+def benchLatency(args):
+    """
+    Measures the round trip latency of small request/response exchanges between a pair of Stockings, each waiting in
+    read for the other's message, without busy polling and with each of the busy poll budgets given; along with the
+    CPU burnt doing so.
+    """
+
+    for busyPoll in [None] + args.busy_poll:
+        client, server = stockingPair(args.stockingClass, sendPolicy=Stockings.SEND_NODELAY, busyPoll=busyPoll)
+
+        def serve():
+            for _ in range(args.round_trips):
+                server.write(server.read(None))
+
+        responder = threading.Thread(target=serve)
+        responder.start()
+        request = b'r' * 64
+        latencies = []
+
+        start, startCpu = time.time(), cpuTime()
+        for _ in range(args.round_trips):
+            sent = time.time()
+            client.write(request)
+            client.read(None)
+            latencies.append(time.time() - sent)
+        elapsed, cpu = time.time() - start, cpuTime() - startCpu
+
+        responder.join()
+        latencies.sort()
+        report("latency[%s]" % ("busy poll %gus" % (busyPoll * 1e6) if busyPoll else "blocking"), args.round_trips,
+               elapsed, p50_us="%.1f" % (percentile(latencies, .5) * 1e6),
+               p99_us="%.1f" % (percentile(latencies, .99) * 1e6), max_us="%.1f" % (latencies[-1] * 1e6),
+               cpu="%.0f%%" % (100 * cpu / elapsed), cpu_us="%.1f" % (cpu / args.round_trips * 1e6))
+        client.close()
+        server.close()
+
+
+BENCHMARKS = {
+    'broadcast': benchBroadcast,
+    'compression': benchCompression,
+    'contention': benchContention,
+    'fanin': benchFanIn,
+    'headers': benchHeaders,
+    'latency': benchLatency,
+    'receive': benchReceive
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stockings benchmark suite.")
+    parser.add_argument('benchmarks', nargs='*',
+                        help="Benchmarks to run (default all); any of %s" % ", ".join(sorted(BENCHMARKS)))
+    parser.add_argument('--stocking', default='poll' if STOCKING_CLASSES['poll'] else 'select',
+                        choices=sorted(STOCKING_CLASSES), help="Flavour of Stocking to benchmark")
+    parser.add_argument('--messages', type=int, default=100000, help="Number of messages to send per run")
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4, 8],
+                        help="Consumer thread counts to run the contention benchmark with")
+    parser.add_argument('--connections', type=int, nargs='+', default=[10, 100, 250],
+                        help="Connection counts to run the broadcast and fanin benchmarks with")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[64, 4096, 262144],
+                        help="Message sizes to run the receive and headers benchmarks with")
+    parser.add_argument('--round-trips', type=int, default=10000, help="Number of round trips per latency run")
+    parser.add_argument('--busy-poll', type=float, nargs='+', default=[.00005, .0005],
+                        help="Busy poll budgets in seconds to run the latency benchmark with, besides blocking")
+    args = parser.parse_args()
+    unknown = [name for name in args.benchmarks if name not in BENCHMARKS]
+    if unknown:
+        parser.error("unknown benchmark(s): %s (choose from %s)" % (", ".join(unknown), ", ".join(sorted(BENCHMARKS))))
+    args.stockingClass = STOCKING_CLASSES[args.stocking]
+
+    for name in args.benchmarks or sorted(BENCHMARKS):
+        BENCHMARKS[name](args)
+
+if __name__ == '__main__':
+    main()
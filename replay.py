@@ -0,0 +1,137 @@
+"""
+    This file is part of Stockings.
+
+    Stockings is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Stockings is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Stockings.  If not, see <http://www.gnu.org/licenses/>.
+
+
+    Author: Warren Spencer
+    Email:  warrenspencer27@gmail.com
+"""
+
+# Standard imports
+import argparse, threading, select, time, collections
+
+# Project imports
+import Stockings
+from Stockings.utils import MessageHeaders
+from bench import STOCKING_CLASSES, stockingPair, report, percentile
+
+
+class Replay(object):
+    """
+    Class implementing the replay of a capture log against pairs of local Stockings; one pair for each stream in the
+    log.  Messages captured as sent are written by the first Stocking of their stream's pair, and messages captured as
+    received are written by the second, so that the traffic of both directions of each connection is reproduced.
+    """
+
+    records = None            # List of CaptureRecords to replay
+    speed = 1                 # Rate to replay the log at, relative to the rate it was captured at; 0 for no delays
+
+    _pairs = None             # Dictionary mapping streams to their pair of Stockings
+    _sendTimes = None         # Dictionary mapping each receiving Stocking to a deque of the times its messages were sent
+    _latencies = None         # List of the latency of each message received
+    _received = 0             # Number of messages received
+
+    def __init__(self, records, stockingClass, speed=1):
+        self.records = records
+        self.speed = speed
+        self._pairs = {}
+        self._sendTimes = {}
+        self._latencies = []
+
+        for record in records:
+            if record.stream not in self._pairs:
+                pair = stockingPair(stockingClass)
+                self._pairs[record.stream] = pair
+                for stocking in pair:
+                    self._sendTimes[stocking] = collections.deque()
+
+
+    def run(self):
+        """ Replays the log, returning once every message has been received or no messages arrive for 10 seconds. """
+
+        consumer = threading.Thread(target=self._consume)
+        consumer.start()
+
+        start = time.time()
+        first = self.records[0].timestamp if self.records else 0
+        for record in self.records:
+            if self.speed:
+                delay = start + (record.timestamp - first) / self.speed - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+
+            sender, receiver = self._pairs[record.stream]
+            if record.direction == Stockings.CAPTURE_RECEIVED:
+                sender, receiver = receiver, sender
+
+            self._sendTimes[receiver].append(time.time())
+            sender.write(self._message(record))
+
+        consumer.join()
+        elapsed = time.time() - start
+
+        for pair in self._pairs.values():
+            for stocking in pair:
+                stocking.close()
+
+        return elapsed
+
+
+    def _message(self, record):
+        """ Returns the message to write for a record; its captured payload, or filler of the same size. """
+
+        payload = record.payload if record.payload is not None else b'\x00' * record.size
+        if record.type == MessageHeaders.MessageHeaders.UNICODE:
+            return payload.decode('utf8', 'replace') if record.payload is not None else u'\x00' * record.size
+
+        return payload
+
+
+    def _consume(self):
+        """ Reads messages from every Stocking until all have been received, recording their latencies. """
+
+        stockings = list(self._sendTimes)
+        lastReceived = time.time()
+        while self._received < len(self.records) and time.time() - lastReceived < 10:
+            for stocking in select.select(stockings, [], [], .1)[0]:
+                while stocking.read() is not None:
+                    self._latencies.append(time.time() - self._sendTimes[stocking].popleft())
+                    self._received += 1
+                    lastReceived = time.time()
+
+
+    def report(self, elapsed):
+        """ Prints the throughput and latencies of the replay. """
+
+        latencies = sorted(self._latencies) or [0]
+        report("replay[%d streams, speed %s]" % (len(self._pairs), self.speed or "max"), self._received, elapsed,
+               p50="%.3fms" % (percentile(latencies, .5) * 1000), p99="%.3fms" % (percentile(latencies, .99) * 1000),
+               max="%.3fms" % (latencies[-1] * 1000), lost=len(self.records) - self._received)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replays a Stockings capture log against local Stockings.")
+    parser.add_argument('log', help="Path of the capture log to replay")
+    parser.add_argument('--stocking', default='poll' if STOCKING_CLASSES['poll'] else 'select',
+                        choices=sorted(STOCKING_CLASSES), help="Flavour of Stocking to replay against")
+    parser.add_argument('--speed', type=float, default=1,
+                        help="Rate to replay at relative to the captured rate, or 0 to replay as fast as possible")
+    args = parser.parse_args()
+
+    replay = Replay(list(Stockings.readCapture(args.log)), STOCKING_CLASSES[args.stocking], args.speed)
+    replay.report(replay.run())
+
+if __name__ == '__main__':
+    main()
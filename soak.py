@@ -0,0 +1,326 @@
+"""
+    This file is part of Stockings.
+
+    Stockings is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Stockings is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Stockings.  If not, see <http://www.gnu.org/licenses/>.
+
+
+    Author: Warren Spencer
+    Email:  warrenspencer27@gmail.com
+"""
+
+# Standard imports
+import argparse, threading, socket, random, time, os, sys
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Project imports
+import Stockings
+from Stockings.utils import wakeup, timerWheel
+from bench import STOCKING_CLASSES
+
+# Globals
+
+# Sizes of the messages sent, and the relative frequency of each
+MESSAGE_SIZES = ((16, 50), (256, 30), (4096, 15), (65536, 5))
+
+
+def rss():
+    """ Returns the resident set size of this process in bytes, or None if it cannot be determined. """
+
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+
+    except (IOError, OSError):
+        pass
+
+    # Otherwise fall back to the peak resident set size, which is reported in kilobytes on Linux and bytes on macOS
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def openFds():
+    """ Returns the number of file descriptors this process has open, or None if it cannot be determined. """
+
+    for path in ('/proc/self/fd', '/dev/fd'):
+        try:
+            return len(os.listdir(path)) - 1
+
+        except (IOError, OSError):
+            pass
+
+
+def cpuTime():
+    """ Returns the number of CPU seconds used by this process. """
+
+    times = os.times()
+    return times[0] + times[1]
+
+
+class Sample(object):
+    """ Class recording the resource usage of this process at a point in time. """
+
+    def __init__(self):
+        self.time = time.time()
+        self.rss = rss()
+        self.threads = threading.active_count()
+        self.fds = openFds()
+        self.cpu = cpuTime()
+
+
+def raiseFdLimit(needed):
+    """ Raises our soft limit on open file descriptors as far as is needed, within the hard limit. """
+
+    if resource is None:
+        return
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != resource.RLIM_INFINITY and soft < needed:
+        target = needed if hard == resource.RLIM_INFINITY else min(needed, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+
+
+def connectedSockets(transport):
+    """ Returns a pair of connected sockets, over the given transport; 'socketpair' or 'tcp'. """
+
+    if transport == 'socketpair':
+        return wakeup.socketpair()
+
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        first = socket.create_connection(listener.getsockname())
+        return first, listener.accept()[0]
+
+    finally:
+        listener.close()
+
+
+class Soak(object):
+    """
+    Class implementing a soak test; opening many pairs of Stockings, pushing mixed traffic through them for a time,
+    then closing them and checking that every thread and file descriptor they used was released.
+    """
+
+    args = None               # Parsed command line arguments
+    pairs = None              # List of (sender, receiver) pairs of Stockings
+
+    _delivered = 0            # Number of messages delivered
+    _deliveredBytes = 0       # Number of bytes delivered
+    _running = True           # Flag signalling our traffic threads to continue
+
+    def __init__(self, args):
+        self.args = args
+        self.pairs = []
+
+
+    def run(self):
+        """ Runs the soak test, returning a boolean indicating whether or not any leaks were found. """
+
+        # Start the shared timer wheel up front, so that its thread is included in our baseline
+        timerWheel.getTimerWheel().schedule(0, lambda: None)
+        time.sleep(.1)
+        baseline = Sample()
+        self.report("baseline", baseline)
+
+        self.open()
+        opened = Sample()
+        self.report("opened", opened, baseline, perConnection=True)
+
+        self.traffic()
+        self.close()
+
+        return not self.checkLeaks(baseline)
+
+
+    def open(self):
+        """ Opens self.args.connections pairs of Stockings, and waits for them to complete their handshakes. """
+
+        options = {}
+        if self.args.heartbeat:
+            options.update(heartbeatInterval=self.args.heartbeat, negotiate=True)
+
+        for _ in range(self.args.connections):
+            first, second = connectedSockets(self.args.transport)
+            self.pairs.append((self.args.stockingClass(first, **options), self.args.stockingClass(second, **options)))
+
+        for pair in self.pairs:
+            for stocking in pair:
+                while stocking.active and not stocking.handshakeComplete:
+                    time.sleep(.001)
+
+
+    def traffic(self):
+        """ Pushes mixed traffic through our Stockings for self.args.duration seconds, reporting as it does so. """
+
+        consumer = threading.Thread(target=self._consume)
+        producer = threading.Thread(target=self._produce)
+        consumer.start()
+        producer.start()
+
+        start = last = Sample()
+        lastDelivered = 0
+        while time.time() - start.time < self.args.duration:
+            time.sleep(min(self.args.interval, max(0, start.time + self.args.duration - time.time())))
+            sample = Sample()
+            delivered = self._delivered
+            self.report("traffic", sample, last, delivered=delivered - lastDelivered)
+            last, lastDelivered = sample, delivered
+
+        self._running = False
+        producer.join()
+        consumer.join()
+
+
+    def close(self):
+        """
+        Closes our Stockings.  Half of the pairs are closed from one end only, leaving the other to notice that its
+        remote has closed before it is closed, so that both paths through close are exercised.
+        """
+
+        for index, (sender, receiver) in enumerate(self.pairs):
+            sender.close()
+            if index % 2:
+                receiver.close()
+
+        deadline = time.time() + 10
+        for _, receiver in self.pairs[::2]:
+            while receiver.active and time.time() < deadline:
+                time.sleep(.001)
+            receiver.close()
+
+        for pair in self.pairs:
+            for stocking in pair:
+                stocking.join(max(0, deadline - time.time()))
+
+        self.pairs = []
+
+
+    def checkLeaks(self, baseline):
+        """ Compares our resource usage to the given baseline, reporting any leaks.  Returns True if any were found. """
+
+        # Give any remaining threads a moment to exit
+        deadline = time.time() + 5
+        while threading.active_count() > baseline.threads and time.time() < deadline:
+            time.sleep(.1)
+
+        closed = Sample()
+        self.report("closed", closed, baseline)
+
+        leaks = []
+        if closed.threads > baseline.threads:
+            leaks.append("%d threads" % (closed.threads - baseline.threads))
+        if closed.fds is not None and closed.fds > baseline.fds:
+            leaks.append("%d file descriptors" % (closed.fds - baseline.fds))
+
+        for leak in leaks:
+            print("LEAK: %s left behind after closing %d Stockings" % (leak, self.args.connections * 2))
+
+        return bool(leaks)
+
+
+    def report(self, phase, sample, previous=None, perConnection=False, delivered=None):
+        """ Prints a single line describing a sample of our resource usage, relative to a previous sample if given. """
+
+        fields = ["%-8s" % phase]
+        if sample.rss is not None:
+            fields.append("rss=%.1fMB" % (sample.rss / 2.**20))
+        fields.append("threads=%d" % sample.threads)
+        if sample.fds is not None:
+            fields.append("fds=%d" % sample.fds)
+
+        if previous is not None:
+            elapsed = sample.time - previous.time
+            fields.append("cpu=%.0f%%" % (100 * (sample.cpu - previous.cpu) / elapsed if elapsed else 0))
+
+            if perConnection:
+                stockings = float(self.args.connections * 2)
+                if sample.rss is not None and previous.rss is not None:
+                    fields.append("rss/stocking=%.1fKB" % ((sample.rss - previous.rss) / stockings / 1024))
+                fields.append("threads/stocking=%.2f" % ((sample.threads - previous.threads) / stockings))
+                if sample.fds is not None:
+                    fields.append("fds/stocking=%.2f" % ((sample.fds - previous.fds) / stockings))
+
+            if delivered is not None:
+                fields.append("delivered=%.0f msgs/s" % (delivered / elapsed))
+
+        print("  ".join(fields))
+
+
+    def _produce(self):
+        """ Writes messages of mixed sizes to randomly chosen Stockings, at self.args.rate messages per second. """
+
+        sizes = [size for size, weight in MESSAGE_SIZES for _ in range(weight)]
+        messages = dict((size, b'm' * size) for size in sizes)
+        interval = 1. / self.args.rate
+        nextWrite = time.time()
+
+        while self._running:
+            sender = random.choice(self.pairs)[0]
+            if sender.active:
+                sender.write(messages[random.choice(sizes)])
+
+            nextWrite += interval
+            delay = nextWrite - time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+
+    def _consume(self):
+        """ Reads every message delivered to our receiving Stockings. """
+
+        selector = Stockings.StockingSelector()
+        for _, receiver in self.pairs:
+            selector.register(receiver)
+
+        while self._running:
+            for _, messages in selector.select(.1):
+                self._delivered += len(messages)
+                self._deliveredBytes += sum(len(message) for message in messages)
+
+        selector.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Soak tests many concurrent Stockings.")
+    parser.add_argument('--connections', type=int, default=1000, help="Number of pairs of Stockings to open")
+    parser.add_argument('--duration', type=float, default=30, help="Number of seconds to push traffic for")
+    parser.add_argument('--interval', type=float, default=5, help="Number of seconds between reports")
+    parser.add_argument('--rate', type=float, default=10000, help="Number of messages per second to send")
+    parser.add_argument('--heartbeat', type=float, default=None, help="If given, the heartbeat interval to negotiate")
+    parser.add_argument('--transport', default='socketpair', choices=('socketpair', 'tcp'),
+                        help="How each pair of Stockings is connected")
+    parser.add_argument('--stocking', default='poll' if STOCKING_CLASSES['poll'] else 'select',
+                        choices=sorted(STOCKING_CLASSES), help="Flavour of Stocking to soak")
+    parser.add_argument('--stack-size', type=int, default=256,
+                        help="Stack size of each Stocking's threads in kilobytes, or 0 for the platform default")
+    args = parser.parse_args()
+    args.stockingClass = STOCKING_CLASSES[args.stocking]
+
+    # Each Stocking uses its socket and the two ends of each of its two wakeups
+    raiseFdLimit(args.connections * 2 * 5 + 256)
+    if args.stack_size:
+        threading.stack_size(args.stack_size * 1024)
+
+    sys.exit(0 if Soak(args).run() else 1)
+
+if __name__ == '__main__':
+    main()
@@ -20,7 +20,7 @@
 """
 
 # Standard imports
-import unittest, socket, time, os, select
+import unittest, socket, time, os, select, threading
 
 os.environ['STOCKING_SELECT_SEND_INTERVAL'] = '0'
 
@@ -30,6 +30,31 @@ import Stockings
 SOCKET_IP = 'localhost'
 SOCKET_PORT = 5005
 
+
+def tlsContexts():
+    """
+    Returns a tuple of server and client ssl.SSLContexts, using a self signed certificate for localhost generated with
+    the openssl command, or None if one cannot be generated.
+    """
+
+    import ssl, subprocess, tempfile
+
+    directory = tempfile.mkdtemp()
+    cert, key = os.path.join(directory, 'cert.pem'), os.path.join(directory, 'key.pem')
+    try:
+        subprocess.check_call(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1', '-keyout', key,
+                               '-out', cert, '-subj', '/CN=localhost', '-addext', 'subjectAltName=DNS:localhost'],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    server = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    server.load_cert_chain(cert, key)
+    client = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    client.load_verify_locations(cert)
+    return server, client
+
 class StockingTests(unittest.TestCase):
 
     serverConn = None
@@ -59,6 +84,22 @@ class StockingTests(unittest.TestCase):
         self.serverConn.close()
         self.clientConn.close()
 
+    def reconnect(self, serverOptions={}, clientOptions={}):
+        """ Replaces our connections with a new pair, created using the given options. """
+
+        self.tearDown()
+
+        clientSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        clientSocket.connect((SOCKET_IP, SOCKET_PORT))
+        serverSocket = self.serverSocket.accept()[0]
+
+        self.serverConn = self.StockingClass(serverSocket, **serverOptions)
+        self.clientConn = self.StockingClass(clientSocket, **clientOptions)
+
+        start = time.time()
+        while not (self.serverConn.handshakeComplete and self.clientConn.handshakeComplete) and time.time() - start < 5:
+            time.sleep(.01)
+
     # Unit tests
     def testInit(self):
         time.sleep(.25)
@@ -84,6 +125,13 @@ class StockingTests(unittest.TestCase):
         self.assertFalse(self.serverConn.active)
         self.assertFalse(self.clientConn.active)
 
+        # Closing a Stocking which was closed by its remote should still release its thread and file descriptors
+        self.clientConn.close()
+        self.clientConn.join(1)
+        self.assertFalse(self.clientConn.is_alive())
+        self.assertEqual(self.clientConn._parentWakeup._reader.fileno(), -1)
+        self.assertEqual(self.clientConn._ioWakeup._reader.fileno(), -1)
+
     def testSerializemessageHeaders(self):
         messageHeaders = self.clientConn._messageHeaders
         for length in (1, 50, 128, 255, 256, 1023, 1024, 1025, 65536):
@@ -183,7 +231,7 @@ class StockingTests(unittest.TestCase):
         self.serverConn.write(msg)
 
         start = time.time()
-        while not self.clientConn._parentIn.poll() and time.time() - start < 15:
+        while not len(self.clientConn._inQueue) and time.time() - start < 15:
             pass
 
         time.sleep(1)
@@ -195,7 +243,7 @@ class StockingTests(unittest.TestCase):
         time.sleep(1)
 
         # Write a header bypassing the _write function
-        self.clientConn._parentOut.send(b'\x01')
+        self.clientConn._queueFrame((bytes, 0, b'\x01', b''))
 
         time.sleep(.1)
 
@@ -203,7 +251,7 @@ class StockingTests(unittest.TestCase):
         self.assertEqual(self.serverConn._messageHeaders._completed, False)
         self.assertEqual(self.serverConn._messageHeaders._msgLength, 1)
 
-        self.clientConn._parentOut.send(b'\x81')
+        self.clientConn._queueFrame((bytes, 0, b'\x81', b''))
 
         time.sleep(.1)
 
@@ -223,7 +271,7 @@ class StockingTests(unittest.TestCase):
 
     def testTwoJoinedMessages(self):
         # Write a header bypassing the _write function
-        self.clientConn._parentOut.send(b'\x81a\x81b')
+        self.clientConn._queueFrame((bytes, 0, b'\x81a\x81b', b''))
 
         time.sleep(.1)
 
@@ -232,6 +280,722 @@ class StockingTests(unittest.TestCase):
         self.assertEqual(self.serverConn.read(), 'b')
 
 
+    def testFileno(self):
+        while not (self.serverConn.handshakeComplete and self.clientConn.handshakeComplete):
+            pass
+
+        # Our fileno should be readable only while there are messages waiting to be read
+        self.assertEqual(select.select([self.clientConn], [], [], 0)[0], [])
+        self.serverConn.write('a')
+        self.serverConn.write('b')
+        self.assertEqual(select.select([self.clientConn], [], [], 1)[0], [self.clientConn])
+        time.sleep(.1)
+        self.assertEqual(self.clientConn.read(), 'a')
+        self.assertEqual(select.select([self.clientConn], [], [], 0)[0], [self.clientConn])
+        self.assertEqual(self.clientConn.read(), 'b')
+        self.assertIsNone(self.clientConn.read())
+        self.assertEqual(select.select([self.clientConn], [], [], 0)[0], [])
+
+        # And permanently readable once the Stocking has closed
+        self.serverConn.close()
+        self.assertEqual(select.select([self.clientConn], [], [], 1)[0], [self.clientConn])
+        self.assertFalse(self.clientConn.active)
+
+
+    def testDrain(self):
+        while not (self.serverConn.handshakeComplete and self.clientConn.handshakeComplete):
+            pass
+
+        self.assertTrue(self.serverConn.drain(0))
+
+        msg = 'a' * 2**22
+        self.serverConn.write(msg)
+        self.assertTrue(self.serverConn.drain(15))
+        self.assertFalse(self.serverConn.writeDataQueued())
+
+        # Coalesced messages should be flushed by drain
+        self.serverConn.setSendPolicy(Stockings.SEND_COALESCE, delay=60)
+        self.serverConn.write('b')
+        self.assertTrue(self.serverConn.drain(5))
+
+        # Closing while draining should not lose queued messages
+        self.serverConn.write('c')
+        self.serverConn.close(drain=True, timeout=5)
+        self.assertFalse(self.serverConn.active)
+
+        start = time.time()
+        while len(self.clientConn._inQueue) < 3 and time.time() - start < 15:
+            time.sleep(.01)
+        self.assertEqual(self.clientConn.read(), msg)
+        self.assertEqual(self.clientConn.read(), 'b')
+        self.assertEqual(self.clientConn.read(), 'c')
+
+        # Messages being compressed by our thread when drain is called should still be waited for
+        self.reconnect({'compression': 6, 'negotiate': True}, {'compression': 6, 'negotiate': True})
+        msg = b'compressible' * 2**21
+        self.serverConn.write(msg)
+        time.sleep(.02)
+        self.serverConn.close(drain=True, timeout=30)
+        self.assertEqual(self.clientConn.read(30), msg)
+
+        # Draining should give up rather than hang if the remote closes with messages still queued
+        self.reconnect()
+        while not (self.serverConn.handshakeComplete and self.clientConn.handshakeComplete):
+            pass
+        # Limit our rate of sending so that most of the messages are still queued when the remote closes
+        self.serverConn.setRateLimits(sendBytes=2**16)
+        for _ in range(200):
+            self.serverConn.write(b'd' * 2**16)
+        results = []
+        drainer = threading.Thread(target=lambda: results.append(self.serverConn.drain()))
+        drainer.start()
+        time.sleep(.1)
+        self.clientConn.close()
+        drainer.join(10)
+        self.assertFalse(drainer.is_alive())
+        self.assertEqual(results, [False])
+        self.assertFalse(self.serverConn.drain())
+
+
+    def testHeartbeats(self):
+        self.assertRaises(TypeError, self.StockingClass, self.serverConn.sock, unknownOption=1)
+
+        # Heartbeats should keep an otherwise idle connection open
+        self.reconnect({'heartbeatInterval': .1, 'negotiate': True}, {'heartbeatInterval': .1, 'negotiate': True})
+        self.assertTrue(self.serverConn._oExtended and self.clientConn._oExtended)
+        time.sleep(1)
+        self.assertTrue(self.serverConn.active and self.clientConn.active)
+
+        self.serverConn.write('a')
+        self.clientConn.write(b'b')
+        time.sleep(.1)
+        self.assertEqual(self.clientConn.read(), 'a')
+        self.assertEqual(self.serverConn.read(), b'b')
+
+        # A Stocking which offers nothing should still negotiate with one which does
+        self.reconnect({'heartbeatInterval': .1, 'negotiate': True}, {'negotiate': True})
+        self.assertTrue(self.serverConn._oExtended and self.clientConn._oExtended)
+        time.sleep(.5)
+        self.assertTrue(self.serverConn.active and self.clientConn.active)
+        self.clientConn.write('c')
+        time.sleep(.1)
+        self.assertEqual(self.serverConn.read(), 'c')
+
+
+    def testOldPeers(self):
+        headers = Stockings.utils.MessageHeaders.MessageHeaders
+
+        # Without opting in to negotiation, nothing but our messages should be sent to a remote, such as one using a
+        # version of Stockings predating negotiation, whatever features we have enabled
+        first, second = socket.socketpair()
+        with self.assertWarns(UserWarning):
+            stocking = self.StockingClass(first, compression=6, heartbeatInterval=60, fixedHeaders=True)
+        start = time.time()
+        while not stocking.handshakeComplete and time.time() - start < 5:
+            time.sleep(.01)
+        self.assertLess(time.time() - start, 1)
+
+        stocking.write(b'message')
+        self.assertTrue(stocking.drain(5))
+        self.assertEqual(second.recv(1024), headers.serialize(bytes, 7) + b'message')
+        stocking.close()
+        second.close()
+
+
+    def testTimeouts(self):
+        # A remote which sends us nothing should be closed once our read timeout elapses
+        self.reconnect({'readTimeout': .3}, {})
+        time.sleep(1)
+        self.assertFalse(self.serverConn.active)
+
+        # As should one which has stopped sending heartbeats
+        self.reconnect({'heartbeatInterval': .1, 'negotiate': True}, {'heartbeatInterval': .1, 'negotiate': True})
+        self.clientConn.heartbeatInterval = 60
+        time.sleep(1)
+        self.assertFalse(self.serverConn.active)
+
+        # Connections on which no messages are sent or received should be closed once idle
+        self.reconnect({'idleTimeout': .5, 'heartbeatInterval': .1, 'negotiate': True},
+                       {'heartbeatInterval': .1, 'negotiate': True})
+        self.serverConn.write('a')
+        time.sleep(.3)
+        self.assertTrue(self.serverConn.active)
+        time.sleep(.7)
+        self.assertFalse(self.serverConn.active)
+
+
+    def testPriority(self):
+        while not (self.serverConn.handshakeComplete and self.clientConn.handshakeComplete):
+            pass
+
+        self.assertRaises(ValueError, self.serverConn.write, 'a', priority=5)
+
+        # Without slicing, messages should be delivered in their entirety regardless of priority
+        self.serverConn.write('a', priority=Stockings.PRIORITY_LOW)
+        self.serverConn.write('b', priority=Stockings.PRIORITY_HIGH)
+        time.sleep(.1)
+        self.assertEqual(sorted([self.clientConn.read(), self.clientConn.read()]), ['a', 'b'])
+
+        # A high priority message should be sent between the slices of a large low priority one
+        self.reconnect({'sliceSize': 2**16, 'negotiate': True}, {'negotiate': True})
+        bulk = 'a' * 2**24
+        self.serverConn.write(bulk, priority=Stockings.PRIORITY_LOW)
+        self.serverConn.write('control', priority=Stockings.PRIORITY_HIGH)
+        self.serverConn.write('normal')
+
+        received = []
+        start = time.time()
+        while len(received) < 3 and time.time() - start < 15:
+            read = self.clientConn.read()
+            if read is None:
+                time.sleep(.01)
+            else:
+                received.append(read)
+
+        self.assertEqual(received, ['control', 'normal', bulk])
+
+
+    def testBorrowBuffers(self):
+        from Stockings.utils import bufferPool
+
+        # Released buffers should be reused, up to the pool's limit
+        pool = bufferPool.BufferPool(minSize=2**6, maxBytes=2**10)
+        buf = pool.acquire(100)
+        self.assertEqual(len(buf), 128)
+        pool.release(buf)
+        self.assertEqual(pool.pooledBytes(), 128)
+        self.assertIs(pool.acquire(120), buf)
+        pool.release(bytearray(2**11))
+        self.assertEqual(pool.pooledBytes(), 0)
+
+        # Borrowed bytes messages should be read as views of pooled buffers, whatever their size
+        self.reconnect({}, {'borrowBuffers': True})
+        for message in (b'borrowed', b'b' * 2**17):
+            self.serverConn.write(message)
+            start = time.time()
+            read = None
+            while read is None and time.time() - start < 5:
+                read = self.clientConn.read()
+
+            self.assertIsInstance(read, memoryview)
+            self.assertEqual(read.tobytes(), message)
+            self.clientConn.release(read)
+
+        # Strings are still decoded
+        self.serverConn.write('unicode')
+        time.sleep(.1)
+        self.assertEqual(self.clientConn.read(), 'unicode')
+
+        # Idle connections should not hold on to a buffer to receive into
+        self.assertIsNone(self.clientConn._rBuffer)
+
+
+    def testCompression(self):
+        message = '{"name": "stocking", "values": [1, 2, 3], "padding": "%s"}' % ('x' * 200)
+
+        # Messages should be compressed when both ends wish to, including slices of larger messages
+        self.reconnect({'compression': 6, 'sliceSize': 2**12, 'negotiate': True}, {'compression': 6, 'negotiate': True})
+        for toSend in (message, message, 'short', message * 100):
+            self.serverConn.write(toSend)
+            start = time.time()
+            read = None
+            while read is None and time.time() - start < 5:
+                read = self.clientConn.read()
+            self.assertEqual(read, toSend)
+
+        stats = self.serverConn.compressionStats()['sent']
+        self.assertGreater(stats['messages'], 2)
+        self.assertGreater(stats['ratio'], 2)
+        self.assertEqual(self.clientConn.compressionStats()['received']['bytes'], stats['bytes'])
+
+        # But not when only one end does
+        self.reconnect({'compression': 6, 'negotiate': True}, {'negotiate': True})
+        self.serverConn.write(message)
+        self.clientConn.write(message)
+        time.sleep(.1)
+        self.assertEqual(self.clientConn.read(), message)
+        self.assertEqual(self.serverConn.read(), message)
+        self.assertIsNone(self.serverConn.compressionStats()['sent']['ratio'])
+
+
+    def testFixedHeaders(self):
+        headers = Stockings.utils.MessageHeaders.MessageHeaders
+        header = headers.serializeFixed(str, 2**33 + 5, headers.FLAG_COMPRESSED)
+        self.assertEqual(len(header), headers.FIXED_SIZE)
+        self.assertEqual(headers.deserializeFixed(b'x' + header, 1), (headers.UNICODE, headers.FLAG_COMPRESSED, 2**33 + 5))
+
+        # Fixed width headers should be used when both ends wish to, for messages of every size and type, including
+        # compressed slices of larger messages
+        self.reconnect({'fixedHeaders': True, 'compression': 6, 'sliceSize': 2**12, 'negotiate': True},
+                       {'fixedHeaders': True, 'negotiate': True})
+        messages = [b'a', u'\u00e9', b'b' * 2**18, 'c' * 2**14] + [b'd' * 1000] * 200
+        for message in messages:
+            self.serverConn.write(message)
+
+        for message in messages:
+            start = time.time()
+            read = None
+            while read is None and time.time() - start < 5:
+                read = self.clientConn.read()
+            self.assertEqual(read, message)
+        self.assertTrue(self.serverConn._oFixed and self.clientConn._iFixed)
+
+        # Messages too long for a fixed width header should be refused by Stockings using them
+        class Huge(object):
+            def __len__(self):
+                return headers.FIXED_MAX_LENGTH + 1
+        tooLong = (bytes, 0, None, Huge())
+        self.assertFalse(self.serverConn._canSend(tooLong))
+        self.assertTrue(self.serverConn._canSend((bytes, 0, None, b'short')))
+
+        # But not when only one end does
+        self.reconnect({'fixedHeaders': True, 'negotiate': True}, {'compression': 6, 'negotiate': True})
+        self.serverConn.write(b'message')
+        time.sleep(.1)
+        self.assertEqual(self.clientConn.read(), b'message')
+        self.assertFalse(self.serverConn._oFixed or self.clientConn._iFixed)
+        self.assertTrue(self.serverConn._canSend(tooLong))
+
+
+    def testTLS(self):
+        contexts = tlsContexts()
+        if contexts is None:
+            self.skipTest("Unable to generate a certificate")
+
+        serverOptions = {'tlsContext': contexts[0], 'tlsServerSide': True}
+        clientOptions = {'tlsContext': contexts[1], 'tlsHostname': 'localhost', 'tlsSessionCache': Stockings.SessionCache()}
+
+        # Messages of every size should be encrypted in both directions, and reconnecting should resume the session
+        for resumed in (False, True):
+            self.reconnect(serverOptions, clientOptions)
+            messages = [b'a', 'b', b'c' * 2**20]
+            for message in messages:
+                self.serverConn.write(message)
+                self.clientConn.write(message)
+
+            for conn in (self.serverConn, self.clientConn):
+                for message in messages:
+                    start = time.time()
+                    read = None
+                    while read is None and time.time() - start < 5:
+                        read = conn.read()
+                    self.assertEqual(read, message)
+
+            self.assertEqual(self.clientConn.tlsState()['version'], 'TLSv1.3')
+            self.assertEqual(self.clientConn.tlsState()['resumed'], resumed)
+            self.assertEqual(self.serverConn.tlsState()['resumed'], resumed)
+
+        # A failed handshake should close both ends
+        clientOptions['tlsHostname'] = 'invalid'
+        self.reconnect(serverOptions, clientOptions)
+        self.clientConn.join(1)
+        self.serverConn.join(1)
+        self.assertFalse(self.clientConn.active or self.serverConn.active)
+        self.assertIsNotNone(self.clientConn.tlsState()['error'])
+
+
+    def testEdgeTriggered(self):
+        # Every message should be received when edge triggered, however much arrives at once, as should the remote closing
+        self.reconnect({'edgeTriggered': True}, {'edgeTriggered': True})
+        messages = [b'm' * 100] * 5000 + [b'l' * 2**20]
+        for message in messages:
+            self.serverConn.write(message)
+
+        for message in messages:
+            start = time.time()
+            read = None
+            while read is None and time.time() - start < 5:
+                read = self.clientConn.read()
+            self.assertEqual(read, message)
+
+        self.serverConn.close()
+        self.clientConn.join(1)
+        self.assertFalse(self.clientConn.active)
+
+
+    def testBusyPoll(self):
+        # Busy polling Stockings should exchange messages as usual, with read waiting for them when given a timeout
+        self.reconnect({'busyPoll': .001}, {'busyPoll': .001})
+        for i in range(100):
+            self.serverConn.write(u'request %d' % i)
+            self.assertEqual(self.clientConn.read(5), u'request %d' % i)
+            self.clientConn.write(u'response %d' % i)
+            self.assertEqual(self.serverConn.read(None), u'response %d' % i)
+
+        # Once nothing is received, read should give up after its timeout, and as soon as the remote closes
+        start = time.time()
+        self.assertIsNone(self.clientConn.read(.1))
+        self.assertGreaterEqual(time.time() - start, .09)
+        self.serverConn.close()
+        self.assertIsNone(self.clientConn.read(None))
+        self.assertFalse(self.clientConn.active)
+
+        # Waiting should work however high our fileno is numbered, including beyond the limit of select.select (which
+        # SelectStockings are themselves subject to)
+        held = []
+        try:
+            if not issubclass(self.StockingClass, Stockings.SelectStocking):
+                held = [socket.socket() for _ in range(1100)]
+        except socket.error:
+            pass
+        try:
+            self.reconnect()
+            start = time.time()
+            self.assertIsNone(self.clientConn.read(.1))
+            self.assertGreaterEqual(time.time() - start, .09)
+            self.serverConn.write('high')
+            self.assertEqual(self.clientConn.read(5), 'high')
+
+        finally:
+            for sock in held:
+                sock.close()
+
+
+    def testMaxMessageSize(self):
+        # Messages larger than the limit should close the connection rather than being received, however they're sent
+        for serverOptions in ({}, {'compression': 6, 'compressionThreshold': 16}, {'sliceSize': 256}):
+            serverOptions['negotiate'] = True
+            clientOptions = {'maxMessageSize': 1000, 'compression': serverOptions.get('compression'), 'negotiate': True}
+            self.reconnect(serverOptions, clientOptions)
+            self.serverConn.write(b'a' * 1000)
+            self.serverConn.write(b'b' * 1001)
+            self.clientConn.join(1)
+            self.assertFalse(self.clientConn.active)
+            self.assertEqual(self.clientConn.read(), b'a' * 1000)
+            self.assertIsNone(self.clientConn.read())
+
+
+    def testSpill(self):
+        import mmap
+
+        # Bytes messages larger than the threshold should be delivered as mmaps, and others as usual
+        self.reconnect({}, {'spillThreshold': 2**17})
+        messages = [b's' * 2**20, b'small', u'u' * 2**18]
+        for message in messages:
+            self.serverConn.write(message)
+
+        for message in messages:
+            start = time.time()
+            read = None
+            while read is None and time.time() - start < 5:
+                read = self.clientConn.read()
+            self.assertEqual(read[:], message)
+            self.assertEqual(isinstance(read, mmap.mmap), message == messages[0])
+
+            if isinstance(read, mmap.mmap):
+                self.clientConn.release(read)
+                self.assertTrue(read.closed)
+
+        # Including those small enough to have been received in their entirety alongside others
+        self.reconnect({}, {'spillThreshold': 1000})
+        messages = [b'before', b'm' * 10000, b'after']
+        headers = Stockings.utils.MessageHeaders.MessageHeaders
+        self.serverConn.sock.send(b''.join(headers.serialize(bytes, len(message)) + message for message in messages))
+        for message in messages:
+            read = self.clientConn.read(5)
+            self.assertEqual(read[:], message)
+            self.assertEqual(isinstance(read, mmap.mmap), message == messages[1])
+
+        # Spilled messages which have not been read, or are part way through being received, should be handed on
+        self.serverConn.write(b'h' * 2**20)
+        header = headers.serialize(bytes, 2**18)
+        time.sleep(.1)
+        self.serverConn.sock.send(header + b'p' * 2**10)
+        time.sleep(.1)
+
+        # The state handed on is larger than the channel's buffer, so must be received as it is sent
+        sender, receiver = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+        receiver.settimeout(5)
+        handoff = threading.Thread(target=Stockings.sendStocking, args=(sender, self.clientConn))
+        handoff.start()
+        self.clientConn = Stockings.recvStocking(receiver, self.StockingClass, spillThreshold=2**17)[0]
+        handoff.join()
+        sender.close()
+        receiver.close()
+
+        self.serverConn.sock.send(b'p' * (2**18 - 2**10))
+        self.assertEqual(self.clientConn.read(5)[:], b'h' * 2**20)
+        read = self.clientConn.read(5)
+        self.assertTrue(isinstance(read, mmap.mmap))
+        self.assertEqual(read[:], b'p' * 2**18)
+        self.clientConn.release(read)
+
+
+    def testCapture(self):
+        import io
+
+        log = io.BytesIO()
+        writer = Stockings.CaptureWriter(log, payloads=True)
+        self.reconnect({'capture': writer}, {})
+        self.serverConn.write(b'sent')
+        self.clientConn.write('received')
+        time.sleep(.1)
+        self.assertEqual(self.clientConn.read(), b'sent')
+        self.assertEqual(self.serverConn.read(), 'received')
+        writer.close()
+
+        log.seek(0)
+        records = list(Stockings.readCapture(log))
+        self.assertEqual([(record.direction, record.size, record.payload) for record in records],
+                         [(Stockings.CAPTURE_SENT, 4, b'sent'), (Stockings.CAPTURE_RECEIVED, 8, b'received')])
+        self.assertEqual(len(set(record.stream for record in records)), 1)
+        self.assertLessEqual(records[0].timestamp, records[1].timestamp)
+
+
+    def testSelector(self):
+        while not (self.serverConn.handshakeComplete and self.clientConn.handshakeComplete):
+            pass
+
+        selector = Stockings.StockingSelector()
+        selector.register(self.serverConn)
+        selector.register(self.clientConn)
+        self.assertEqual(selector.select(0), [])
+
+        for message in ('a', 'b', 'c'):
+            self.serverConn.write(message)
+        time.sleep(.1)
+        self.assertEqual(selector.select(1, maxMessages=2), [(self.clientConn, ['a', 'b'])])
+        self.assertEqual(selector.select(1), [(self.clientConn, ['c'])])
+
+        # Stockings closed by their remote should be returned, and unregistered
+        selector.unregister(self.clientConn)
+        self.clientConn.close()
+        self.assertEqual(selector.select(1), [(self.serverConn, [])])
+        self.assertEqual(len(selector), 0)
+        selector.close()
+        self.assertIsNone(selector._selector)
+
+        # Stockings which are still handshaking should not be returned, or wake us, until their handshakes complete
+        class SlowHandshake(self.StockingClass):
+            def handshake(self):
+                time.sleep(.5)
+                return True
+
+        first, second = socket.socketpair()
+        slow, remote = SlowHandshake(first), self.StockingClass(second)
+        while not remote.handshakeComplete:
+            time.sleep(.01)
+        remote.write('early')
+        time.sleep(.1)
+
+        selector = Stockings.StockingSelector()
+        selector.register(slow)
+        start = time.time()
+        self.assertEqual(selector.select(.2), [])
+        self.assertGreaterEqual(time.time() - start, .19)
+        self.assertEqual(selector.select(2), [(slow, ['early'])])
+        selector.close()
+        slow.close()
+        remote.close()
+
+        # Selecting on nothing should wait for as long as we're asked to
+        waiter = threading.Thread(target=Stockings.StockingSelector().select)
+        waiter.daemon = True
+        waiter.start()
+        waiter.join(.2)
+        self.assertTrue(waiter.is_alive())
+
+
+    def testBufferWrite(self):
+        import array
+
+        while not (self.serverConn.handshakeComplete and self.clientConn.handshakeComplete):
+            pass
+
+        # Objects supporting the buffer protocol should be sent as bytes, calling back once they've been sent
+        sent = []
+        data = bytearray(b'b' * 5000)
+        numbers = array.array('i', [1, 2, 3])
+        self.serverConn.write(data, onSent=sent.append)
+        self.serverConn.write(memoryview(b'view'))
+        self.serverConn.write(numbers, onSent=sent.append)
+        time.sleep(.1)
+        self.assertEqual(sent, [True, True])
+        self.assertEqual(self.clientConn.read(), bytes(data))
+        self.assertEqual(self.clientConn.read(), b'view')
+        self.assertEqual(self.clientConn.read(), numbers.tobytes())
+
+        # Objects which are not contiguous should be copied rather than stopping our thread
+        strided = memoryview(bytearray(b'0123456789'))[::2]
+        self.serverConn.write(strided)
+        self.serverConn.write(memoryview(numbers)[::-1])
+        time.sleep(.1)
+        self.assertTrue(self.serverConn.active)
+        self.assertEqual(self.clientConn.read(), b'02468')
+        self.assertEqual(self.clientConn.read(), array.array('i', [3, 2, 1]).tobytes())
+
+        # Callbacks of messages which are never sent should be told so
+        self.serverConn.setSendPolicy(Stockings.SEND_COALESCE, delay=5)
+        self.serverConn.write(data, onSent=sent.append)
+        self.serverConn.close()
+        time.sleep(.1)
+        self.assertEqual(sent, [True, True, False])
+
+
+    def testRateLimits(self):
+        def readAll(stocking):
+            messages = []
+            while stocking.read() is not None:
+                messages.append(None)
+            return len(messages)
+
+        # Messages beyond our send limit should be held back until it allows them, or it is raised
+        self.reconnect({'rateLimiter': Stockings.RateLimiter(sendMessages=20, burst=.1)}, {})
+        for _ in range(10):
+            self.serverConn.write('m')
+        time.sleep(.2)
+        received = readAll(self.clientConn)
+        self.assertLess(received, 10)
+        self.assertEqual(self.serverConn.rateLimitState()['connection']['sendMessages']['rate'], 20)
+
+        self.serverConn.setRateLimits(sendMessages=None)
+        time.sleep(.1)
+        self.assertEqual(received + readAll(self.clientConn), 10)
+        self.assertEqual(self.serverConn.rateLimitState(), {'connection': {}, 'group': None})
+
+        # Receive limits shared by a group should hold back further receives once exceeded
+        group = Stockings.RateLimiter(recvBytes=10000, burst=.1)
+        self.reconnect({}, {'rateGroup': group})
+        self.serverConn.write('a' * 5000)
+        time.sleep(.1)
+        self.assertEqual(self.clientConn.read(), 'a' * 5000)
+        self.serverConn.write('b')
+        time.sleep(.1)
+        self.assertIsNone(self.clientConn.read())
+        time.sleep(.5)
+        self.assertEqual(self.clientConn.read(), 'b')
+        self.assertIn('recvBytes', self.clientConn.rateLimitState()['group'])
+
+
+    @unittest.skipUnless(hasattr(socket, 'AF_UNIX'), "Requires Unix domain sockets")
+    def testHandoff(self):
+        while not (self.serverConn.handshakeComplete and self.clientConn.handshakeComplete):
+            pass
+
+        # Leave a message unread, and another part way through being received
+        self.clientConn.write('unread')
+        time.sleep(.1)
+        header = Stockings.utils.MessageHeaders.MessageHeaders.serialize(str, 10)
+        self.clientConn.sock.send(header + b'part')
+        time.sleep(.1)
+
+        # Data which cannot be handed on should be refused without detaching the Stocking
+        sender, receiver = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.assertRaises(Exception, Stockings.sendStocking, sender, self.serverConn, lambda: None)
+        self.assertTrue(self.serverConn.active)
+
+        # Messages still waiting to be sent are handed on, but their callbacks cannot be
+        sent = []
+        self.serverConn.setSendPolicy(Stockings.SEND_COALESCE, delay=5)
+        self.serverConn.write('held', onSent=sent.append)
+
+        Stockings.sendStocking(sender, self.serverConn, {'user': 'name'})
+        self.assertFalse(self.serverConn.active)
+        self.assertEqual(sent, [False])
+        resumed, data = Stockings.recvStocking(receiver, self.StockingClass)
+        sender.close()
+        receiver.close()
+        self.serverConn = resumed
+
+        self.assertEqual(data, {'user': 'name'})
+        self.assertTrue(resumed.handshakeComplete)
+        self.clientConn.sock.send(b'ial!!!')
+        self.clientConn.write('after')
+        time.sleep(.1)
+        self.assertEqual(resumed.read(), 'unread')
+        self.assertEqual(resumed.read(), 'partial!!!')
+        self.assertEqual(resumed.read(), 'after')
+
+        resumed.write('resumed')
+        time.sleep(.1)
+        self.assertEqual(self.clientConn.read(), 'held')
+        self.assertEqual(self.clientConn.read(), 'resumed')
+
+        # A Stocking still expecting the remote's hello should continue to once resumed
+        self.reconnect({'negotiate': True}, {'negotiate': True})
+        self.assertTrue(self.serverConn._helloExpected)
+        sender, receiver = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+        Stockings.sendStocking(sender, self.serverConn)
+        resumed, _ = Stockings.recvStocking(receiver, self.StockingClass)
+        sender.close()
+        receiver.close()
+        self.serverConn = resumed
+        self.assertTrue(resumed._helloExpected)
+
+
+    def testBroadcast(self):
+        while not (self.serverConn.handshakeComplete and self.clientConn.handshakeComplete):
+            pass
+
+        sentTo = Stockings.broadcast([self.serverConn, self.clientConn], 'broadcast')
+        self.assertEqual(sentTo, [self.serverConn, self.clientConn])
+        time.sleep(.1)
+        self.assertEqual(self.clientConn.read(), 'broadcast')
+        self.assertEqual(self.serverConn.read(), 'broadcast')
+
+        # Closed Stockings should be skipped
+        self.clientConn.close()
+        time.sleep(.1)
+        self.assertEqual(Stockings.broadcast([self.clientConn], 'broadcast', Stockings.BROADCAST_SKIP), [])
+
+        self.assertRaises(ValueError, Stockings.broadcast, [self.serverConn], 'broadcast', 'unknown')
+
+        # preWrite may depend on the state of each Stocking, unless its class declares otherwise
+        class Prefixed(self.StockingClass):
+            def preWrite(self, message):
+                return self.prefix + message
+
+        pairs = [[Prefixed(sock) for sock in socket.socketpair()] for _ in range(2)]
+        for prefix, pair in zip('ab', pairs):
+            for stocking in pair:
+                stocking.prefix = prefix
+                while not stocking.handshakeComplete:
+                    time.sleep(.01)
+
+        for broadcastSafe, expected in ((False, ['a!', 'b!']), (True, ['a!', 'a!'])):
+            Prefixed.broadcastSafe = broadcastSafe
+            Stockings.broadcast([sender for sender, _ in pairs], '!')
+            self.assertEqual([receiver.read(1) for _, receiver in pairs], expected)
+
+        for pair in pairs:
+            for stocking in pair:
+                stocking.close()
+
+
+    def testSendPolicy(self):
+        while not (self.serverConn.handshakeComplete and self.clientConn.handshakeComplete):
+            pass
+
+        self.serverConn.setSendPolicy(Stockings.SEND_NODELAY)
+        self.assertTrue(self.serverConn.sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY))
+        self.serverConn.write('a')
+        time.sleep(.1)
+        self.assertEqual(self.clientConn.read(), 'a')
+
+        # Coalesced messages should be held back until they're flushed
+        self.serverConn.setSendPolicy(Stockings.SEND_COALESCE, delay=5)
+        self.serverConn.write('b')
+        self.serverConn.write('c')
+        time.sleep(.1)
+        self.assertIsNone(self.clientConn.read())
+        self.serverConn.flush()
+        time.sleep(.1)
+        self.assertEqual(self.clientConn.read(), 'b')
+        self.assertEqual(self.clientConn.read(), 'c')
+
+        # Or until their delay has elapsed
+        self.serverConn.setSendPolicy(Stockings.SEND_COALESCE, delay=.1)
+        self.serverConn.write('d')
+        time.sleep(.3)
+        self.assertEqual(self.clientConn.read(), 'd')
+
+        # Returning to the default policy should restore Nagle's algorithm
+        self.serverConn.setSendPolicy(Stockings.SEND_DEFAULT)
+        self.assertFalse(self.serverConn.sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY))
+
+        self.assertRaises(ValueError, self.serverConn.setSendPolicy, 'unknown')
+
+
 class PollTests(StockingTests):
     StockingClass = Stockings.PollStocking
 